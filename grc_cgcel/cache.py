@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from db.db import get_session
+
+GRC_CACHE_TTL_SECONDS = float(os.getenv("GRC_CACHE_TTL_SECONDS", "60"))
+GRC_CACHE_MAX_ENTRIES = int(os.getenv("GRC_CACHE_MAX_ENTRIES", "256"))
+GRC_CACHE_CHANNEL = "grc_cgcel_cache"
+GRC_CACHE_HEARTBEAT_SECONDS = 30
+GRC_CACHE_RETRY_SECONDS = 5
+
+
+class GRCReadCache:
+    """
+    TTL + LRU cache for GRC lookups, shared by the requests of one worker.
+
+    Entries are keyed by change counter scope ("receive",
+    "return:<division>") and stored with the entity tag the caller read
+    for that scope before running the query. An entry is served only to a
+    caller holding the same tag, so a write made by any worker is seen as
+    soon as its counter bump commits. Writers also NOTIFY the scopes they
+    changed on GRC_CACHE_CHANNEL, and every worker LISTENs on a dedicated
+    connection to drop the superseded entries early; that only frees
+    memory, correctness never depends on it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = GRC_CACHE_MAX_ENTRIES,
+        ttl: float = GRC_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str, tag: str):
+        self._ensure_listener()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, entry_tag, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        if entry_tag != tag:
+            # Written under another counter value; the caller's query
+            # replaces it
+            self.stale += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, tag: str, value):
+        # tag must have been read before the query that produced value, so
+        # value is never older than the tag it is served under
+        self._entries[key] = (time.monotonic() + self.ttl, tag, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, scopes: Iterable[str]):
+        # "upload" can touch every division, so it drops all return sheets
+        for scope in scopes:
+            if scope == "upload":
+                keys = [key for key in self._entries if key.startswith("return:")]
+            else:
+                keys = [scope]
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "listening": self.listening,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async for session in get_session():
+                    engine = session.bind
+                # A plain connection outside any transaction; LISTEN only
+                # delivers between transactions
+                async with engine.connect() as connection:
+                    raw = await connection.get_raw_connection()
+                    driver = raw.driver_connection
+                    await driver.add_listener(GRC_CACHE_CHANNEL, self._on_notify)
+                    try:
+                        # Entries superseded while we were not listening
+                        # would otherwise sit until they expire
+                        self.clear()
+                        self.listening = True
+                        while True:
+                            await asyncio.sleep(GRC_CACHE_HEARTBEAT_SECONDS)
+                            await driver.execute("SELECT 1")
+                    finally:
+                        self.listening = False
+                        # The connection goes back to the pool without LISTEN
+                        if not driver.is_closed():
+                            await driver.remove_listener(
+                                GRC_CACHE_CHANNEL, self._on_notify
+                            )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.clear()
+                await asyncio.sleep(GRC_CACHE_RETRY_SECONDS)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.invalidate(payload.split(","))
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi import UploadFile
+from fastapi.datastructures import Headers
+
+from db.db import get_session
+from grc_cgcel.service import GRCCGCELService
+
+GRC_UPLOAD_JOB_WORKERS = int(os.getenv("GRC_UPLOAD_JOB_WORKERS", "2"))
+GRC_UPLOAD_SPOOL_DIR = os.getenv(
+    "GRC_UPLOAD_SPOOL_DIR",
+    os.path.join(tempfile.gettempdir(), "grc_cgcel_uploads"),
+)
+GRC_UPLOAD_SPOOL_CHUNK_SIZE = 1024 * 1024
+# Finished job state (and any leftover upload) is removed after this long
+GRC_UPLOAD_JOB_RETENTION_SECONDS = int(
+    os.getenv("GRC_UPLOAD_JOB_RETENTION_SECONDS", str(7 * 24 * 3600))
+)
+
+
+def process_identity(pid: int) -> Optional[str]:
+    # "<pid>:<start time>", or None when no such process is running. The
+    # start time (from /proc) tells a restarted server apart from the one
+    # before it, which often had the same pid (PID 1 in a container).
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except FileNotFoundError:
+        if os.path.isdir("/proc/self"):
+            return None
+        # No /proc: all that can be checked is that the pid is in use
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return str(pid)
+    # The command name may contain spaces, so split after its ")"; starttime
+    # is field 22 of the stat line
+    return f"{pid}:{stat[stat.rindex(')') + 2 :].split()[19]}"
+
+
+class GRCUploadJobManager:
+    """
+    Runs GRC uploads outside the HTTP request.
+
+    The upload is spooled to disk and queued for a small pool of asyncio
+    workers. Job state is kept as a JSON file next to the spooled upload, so
+    any uvicorn worker on the host can answer a poll, and a job keeps running
+    after the client that submitted it disconnects. The queue lives in the
+    process that accepted the upload, so each job records that process
+    (pid and start time). A job whose process is gone can never finish;
+    such jobs are marked failed when a manager starts or a job is
+    submitted, and when they are polled. The same sweep removes finished
+    jobs after GRC_UPLOAD_JOB_RETENTION_SECONDS.
+    """
+
+    def __init__(
+        self,
+        service: GRCCGCELService,
+        workers: int = GRC_UPLOAD_JOB_WORKERS,
+        spool_dir: str = GRC_UPLOAD_SPOOL_DIR,
+    ):
+        self.service = service
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self.owner = process_identity(os.getpid())
+        self._sweep()
+
+    async def submit(
+        self, file: UploadFile, engine: str = "auto", token: Optional[dict] = None
+    ) -> dict:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        await asyncio.to_thread(self._sweep)
+        job_id = uuid.uuid4().hex
+        spool_path = self._path(job_id, "csv")
+
+        size = 0
+        with open(spool_path, "wb") as out:
+            while chunk := await file.read(GRC_UPLOAD_SPOOL_CHUNK_SIZE):
+                await asyncio.to_thread(out.write, chunk)
+                size += len(chunk)
+
+        state = {
+            "job_id": job_id,
+            "status": "queued",
+            "file_name": file.filename,
+            "content_type": file.content_type,
+            "file_size": size,
+            "engine": engine,
+            "rows_processed": 0,
+            "rows_per_second": 0,
+            "elapsed_seconds": 0,
+            "warnings": [],
+            "result": None,
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "owner": self.owner,
+        }
+        self._save(state)
+
+        self._ensure_workers()
+        await self._queue.put((job_id, token))
+        return state
+
+    def status(self, job_id: str) -> Optional[dict]:
+        # Job ids are generated hex strings; anything else cannot be ours
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id, "json")) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if self._is_interrupted(state):
+            self._fail_interrupted(state)
+        return state
+
+    def _is_interrupted(self, state: dict) -> bool:
+        # Queued or running, but the process holding it has exited. Jobs
+        # saved before owners were recorded cannot have outlived it either.
+        if state["status"] not in ("queued", "running"):
+            return False
+        owner = state.get("owner")
+        if owner is None:
+            return True
+        if owner == self.owner:
+            return False
+        pid = int(owner.split(":")[0])
+        return process_identity(pid) != owner
+
+    def _fail_interrupted(self, state: dict):
+        state["status"] = "failed"
+        state["warnings"].append("Upload interrupted by a server restart")
+        state["result"] = {
+            "message": "Processing interrupted",
+            "resolution": "Upload the file again",
+            "type": "error",
+        }
+        state["finished_at"] = datetime.now().isoformat()
+        self._save(state)
+        spool_path = self._path(state["job_id"], "csv")
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+    def _sweep(self):
+        # Fails interrupted jobs and removes finished ones past retention
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return
+        expired_before = time.time() - GRC_UPLOAD_JOB_RETENTION_SECONDS
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            try:
+                modified = os.stat(path).st_mtime
+                with open(path) as f:
+                    state = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            if self._is_interrupted(state):
+                self._fail_interrupted(state)
+            elif state["status"] not in ("queued", "running") and (
+                modified < expired_before
+            ):
+                for extension in ("json", "csv"):
+                    try:
+                        os.remove(self._path(state["job_id"], extension))
+                    except FileNotFoundError:
+                        pass
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            job_id, token = await self._queue.get()
+            try:
+                await self._run(job_id, token)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, token: Optional[dict]):
+        state = self.status(job_id)
+        spool_path = self._path(job_id, "csv")
+        started = time.monotonic()
+
+        def progress(rows_processed: int):
+            elapsed = time.monotonic() - started
+            state["rows_processed"] = rows_processed
+            state["elapsed_seconds"] = round(elapsed, 2)
+            state["rows_per_second"] = round(rows_processed / elapsed) if elapsed else 0
+            self._save(state)
+
+        state["status"] = "running"
+        self._save(state)
+
+        try:
+            with open(spool_path, "rb") as f:
+                # The content type is part of how the service detects Excel
+                content_type = state.get("content_type")
+                file = UploadFile(
+                    file=f,
+                    filename=state["file_name"],
+                    size=state["file_size"],
+                    headers=Headers(
+                        {"content-type": content_type} if content_type else {}
+                    ),
+                )
+                async for session in get_session():
+                    result = await self.service.upload_grc_cgcel(
+                        session, file, state["engine"], token, progress
+                    )
+            if result.get("type") in ("warning", "error"):
+                state["status"] = "failed"
+                state["warnings"].append(result.get("resolution"))
+            else:
+                state["status"] = "done"
+            state["result"] = result
+        except Exception as exc:
+            state["status"] = "failed"
+            state["warnings"].append(str(exc))
+            state["result"] = {
+                "message": "Processing failed",
+                "resolution": str(exc),
+                "type": "error",
+            }
+        finally:
+            elapsed = time.monotonic() - started
+            state["elapsed_seconds"] = round(elapsed, 2)
+            state["finished_at"] = datetime.now().isoformat()
+            self._save(state)
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+
+    def _path(self, job_id: str, extension: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.{extension}")
+
+    def _save(self, state: dict):
+        # Write then rename so a concurrent poll never reads half a file
+        path = self._path(state["job_id"], "json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
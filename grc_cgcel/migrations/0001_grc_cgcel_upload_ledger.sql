@@ -0,0 +1,17 @@
+-- Content-hash delta uploads for GRC CGCEL.
+-- create_all builds the new ledger table on a fresh database, but it does
+-- not add columns to an existing grc_cgcel table, so apply this once.
+
+ALTER TABLE grc_cgcel ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+
+CREATE TABLE IF NOT EXISTS grc_cgcel_upload_ledger (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    file_name VARCHAR(255),
+    file_hash CHAR(64) NOT NULL,
+    row_count INTEGER NOT NULL,
+    inserted INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    unchanged INTEGER NOT NULL,
+    uploaded_by VARCHAR(30) REFERENCES users (username),
+    uploaded_at TIMESTAMP NOT NULL
+);
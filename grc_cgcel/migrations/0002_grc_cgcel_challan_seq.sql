@@ -0,0 +1,13 @@
+-- Race-free challan numbers for GRC CGCEL returns.
+-- Creates the sequence and starts it after the highest challan already
+-- issued, so the next finalize continues the existing G0000N series.
+
+CREATE SEQUENCE IF NOT EXISTS grc_cgcel_challan_seq START WITH 1;
+
+SELECT setval(
+    'grc_cgcel_challan_seq',
+    COALESCE(MAX(SUBSTRING(challan_number FROM 2)::INTEGER), 0) + 1,
+    false
+)
+FROM grc_cgcel_return_history
+WHERE challan_number ~ '^G[0-9]+$';
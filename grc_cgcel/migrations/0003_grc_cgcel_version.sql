@@ -0,0 +1,5 @@
+-- Optimistic concurrency for GRC CGCEL receive/return editing.
+-- Every receive, save and finalize bumps version; clients send back the
+-- version they read and get a 409 if the row changed in between.
+
+ALTER TABLE grc_cgcel ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
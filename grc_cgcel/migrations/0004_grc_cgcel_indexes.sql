@@ -0,0 +1,29 @@
+-- Indexes for the GRC CGCEL access paths (declared in grc_cgcel/models.py).
+-- CONCURRENTLY keeps receive/return usable while the indexes build; run
+-- this file outside a transaction block (e.g. psql -f, not BEGIN ... COMMIT).
+
+-- not_received_grc_numbers / not_received_by_grc_number
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_not_received
+    ON grc_cgcel (grc_number)
+    WHERE receive_date IS NULL;
+
+-- grc_return_by_division (ordered by grc_number) and upload reconcile
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_open_division
+    ON grc_cgcel (division, grc_number)
+    WHERE status = 'N';
+
+-- Enquiry filters
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_challan_number
+    ON grc_cgcel (challan_number);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_grc_date
+    ON grc_cgcel (grc_date);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_return_history_challan_number
+    ON grc_cgcel_return_history (challan_number);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_return_history_grc_date
+    ON grc_cgcel_return_history (grc_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_return_history_grc_number
+    ON grc_cgcel_return_history (grc_number);
+
+ANALYZE grc_cgcel;
+ANALYZE grc_cgcel_return_history;
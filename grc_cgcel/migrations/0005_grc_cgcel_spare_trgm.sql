@@ -0,0 +1,14 @@
+-- Trigram indexes for prefix/substring/fuzzy spare search on enquiry
+-- (declared in grc_cgcel/models.py). Run outside a transaction block.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_spare_code_trgm
+    ON grc_cgcel USING gin (spare_code gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_spare_description_trgm
+    ON grc_cgcel USING gin (spare_description gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_return_history_spare_code_trgm
+    ON grc_cgcel_return_history USING gin (spare_code gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_grc_cgcel_return_history_spare_description_trgm
+    ON grc_cgcel_return_history USING gin (spare_description gin_trgm_ops);
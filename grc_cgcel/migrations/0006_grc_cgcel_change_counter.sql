@@ -0,0 +1,8 @@
+-- Change counters behind the ETags on the GRC CGCEL read routes.
+-- Upload, receive, save and finalize bump their scopes in the writing
+-- transaction; a missing scope row reads as version 0.
+
+CREATE TABLE IF NOT EXISTS grc_cgcel_change_counter (
+    scope VARCHAR(40) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
@@ -1,12 +1,43 @@
-from datetime import date
+from datetime import date, datetime
 
 import sqlalchemy.dialects.postgresql as pg
-from sqlalchemy import Identity
+from sqlalchemy import DDL, Identity, Index, MetaData, Sequence, Table, event, text
 from sqlmodel import Column, Field, ForeignKey, SQLModel
 
 
 class GRCCGCEL(SQLModel, table=True):
     __tablename__ = "grc_cgcel"
+    __table_args__ = (
+        # not_received_grc_numbers / not_received_by_grc_number
+        Index(
+            "ix_grc_cgcel_not_received",
+            "grc_number",
+            postgresql_where=text("receive_date IS NULL"),
+        ),
+        # grc_return_by_division (ordered by grc_number) and upload reconcile
+        Index(
+            "ix_grc_cgcel_open_division",
+            "division",
+            "grc_number",
+            postgresql_where=text("status = 'N'"),
+        ),
+        # Enquiry filters
+        Index("ix_grc_cgcel_challan_number", "challan_number"),
+        Index("ix_grc_cgcel_grc_date", "grc_date"),
+        # Prefix/substring/fuzzy spare search (pg_trgm)
+        Index(
+            "ix_grc_cgcel_spare_code_trgm",
+            "spare_code",
+            postgresql_using="gin",
+            postgresql_ops={"spare_code": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_grc_cgcel_spare_description_trgm",
+            "spare_description",
+            postgresql_using="gin",
+            postgresql_ops={"spare_description": "gin_trgm_ops"},
+        ),
+    )
 
     division: str = Field(sa_column=Column(pg.VARCHAR(20), nullable=False))
     spare_code: str = Field(
@@ -40,6 +71,10 @@ class GRCCGCEL(SQLModel, table=True):
     alt_spare_qty: int = Field(sa_column=Column(pg.INTEGER, nullable=True))
     alt_spare_code: str = Field(sa_column=Column(pg.VARCHAR(30), nullable=True))
     invoice: str = Field(sa_column=Column(pg.CHAR(1), nullable=True), default="N")
+    row_hash: str = Field(sa_column=Column(pg.CHAR(32), nullable=True))
+    version: int = Field(
+        sa_column=Column(pg.INTEGER, nullable=False, server_default="0"), default=0
+    )
 
     def __repr__(self):
         return f"<GRC {self.spare_code}>"
@@ -71,6 +106,25 @@ class GRCCGCELDispute(SQLModel, table=True):
 
 class GRCCGCELReturnHistory(SQLModel, table=True):
     __tablename__ = "grc_cgcel_return_history"
+    __table_args__ = (
+        # Enquiry filters
+        Index("ix_grc_cgcel_return_history_challan_number", "challan_number"),
+        Index("ix_grc_cgcel_return_history_grc_date", "grc_date"),
+        Index("ix_grc_cgcel_return_history_grc_number", "grc_number"),
+        # Prefix/substring/fuzzy spare search (pg_trgm)
+        Index(
+            "ix_grc_cgcel_return_history_spare_code_trgm",
+            "spare_code",
+            postgresql_using="gin",
+            postgresql_ops={"spare_code": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_grc_cgcel_return_history_spare_description_trgm",
+            "spare_description",
+            postgresql_using="gin",
+            postgresql_ops={"spare_description": "gin_trgm_ops"},
+        ),
+    )
 
     id: int = Field(
         sa_column=Column(
@@ -100,3 +154,88 @@ class GRCCGCELReturnHistory(SQLModel, table=True):
 
     def __repr__(self):
         return f"<GRCReturnHistory {self.spare_code}>"
+
+
+# The gin_trgm_ops indexes above need pg_trgm, which create_all does not
+# install on a fresh database (migration 0005 does it for existing ones)
+for _table in (GRCCGCEL.__table__, GRCCGCELReturnHistory.__table__):
+    event.listen(
+        _table,
+        "before_create",
+        DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+    )
+
+
+# Challan numbers (G00001, G00002, ...) are drawn from this sequence
+grc_cgcel_challan_seq = Sequence(
+    "grc_cgcel_challan_seq", start=1, metadata=SQLModel.metadata
+)
+
+
+class GRCCGCELUploadLedger(SQLModel, table=True):
+    __tablename__ = "grc_cgcel_upload_ledger"
+
+    id: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            Identity(always=False),
+            primary_key=True,
+        )
+    )
+    file_name: str = Field(sa_column=Column(pg.VARCHAR(255), nullable=True))
+    file_hash: str = Field(sa_column=Column(pg.CHAR(64), nullable=False))
+    row_count: int = Field(sa_column=Column(pg.INTEGER, nullable=False))
+    inserted: int = Field(sa_column=Column(pg.INTEGER, nullable=False))
+    updated: int = Field(sa_column=Column(pg.INTEGER, nullable=False))
+    unchanged: int = Field(sa_column=Column(pg.INTEGER, nullable=False))
+    uploaded_by: str = Field(
+        sa_column=Column(pg.VARCHAR(30), ForeignKey("users.username"), nullable=True)
+    )
+    uploaded_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, nullable=False))
+
+    def __repr__(self):
+        return f"<GRCUploadLedger {self.file_hash}>"
+
+
+class GRCCGCELChangeCounter(SQLModel, table=True):
+    __tablename__ = "grc_cgcel_change_counter"
+
+    # Bumped in the writing transaction; read routes build ETags from it.
+    # Scopes: "receive", "upload", "return:<division>"
+    scope: str = Field(sa_column=Column(pg.VARCHAR(40), primary_key=True))
+    version: int = Field(
+        sa_column=Column(pg.BIGINT, nullable=False, server_default=text("0"))
+    )
+
+    def __repr__(self):
+        return f"<GRCChangeCounter {self.scope}>"
+
+
+# Per-transaction staging table for bulk GRC uploads (COPY target). It lives
+# in its own MetaData so create_all never builds it as a permanent table.
+grc_cgcel_stage = Table(
+    "grc_cgcel_stage",
+    MetaData(),
+    Column("spare_code", pg.VARCHAR(30), nullable=False),
+    Column("division", pg.VARCHAR(20), nullable=False),
+    Column("spare_description", pg.VARCHAR(40), nullable=False),
+    Column("grc_number", pg.INTEGER, nullable=False),
+    Column("grc_date", pg.DATE, nullable=False),
+    Column("issue_qty", pg.INTEGER, nullable=False),
+    Column("grc_pending_qty", pg.INTEGER, nullable=False),
+    Column("row_hash", pg.CHAR(32), nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+# Every key in the uploaded file, changed or not, anti-joined by the status
+# reconciliation step. Keys may repeat across batches, so there is no PK.
+grc_cgcel_upload_keys = Table(
+    "grc_cgcel_upload_keys",
+    MetaData(),
+    Column("spare_code", pg.VARCHAR(30), nullable=False),
+    Column("grc_number", pg.INTEGER, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
@@ -0,0 +1,435 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from typing import AsyncIterator, List, Optional, Tuple
+
+from PyPDF2 import PageObject, PdfReader, PdfWriter
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from utils.file_utils import safe_join
+
+# Processes rendering report PDFs; 0 renders on a thread of this process
+GRC_REPORT_WORKERS = int(os.getenv("GRC_REPORT_WORKERS", "2"))
+# Rendered PDFs are written here and streamed back from disk
+GRC_REPORT_SPOOL_DIR = os.getenv(
+    "GRC_REPORT_SPOOL_DIR",
+    os.path.join(tempfile.gettempdir(), "grc_cgcel_reports"),
+)
+GRC_REPORT_CHUNK_SIZE = 64 * 1024
+# Bump whenever render_grc_report draws differently; it is part of the
+# report store key, so PDFs stored by an older layout are never served
+GRC_REPORT_LAYOUT_VERSION = 2
+
+
+class GRCTemplateRegistry:
+    """
+    Report templates, read and parsed once per process.
+
+    Each worker process keeps its own registry. A template is parsed again
+    only when its file's mtime changes, so editing a template on disk takes
+    effect on the next render without a restart.
+    """
+
+    def __init__(self, static_dir: Optional[str] = None):
+        # Path to the static PDF templates (absolute, for portability)
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.static_dir = static_dir or os.path.normpath(
+            os.path.join(base_dir, "..", "static")
+        )
+        self._templates = {}
+        self._hashes = {}
+
+    def path(self, report_type: str) -> str:
+        # safe_join guards the static dir against path injection
+        if report_type == "Defective":
+            return safe_join(self.static_dir, "grc_cgcel_defective.pdf")
+        if report_type == "Good":
+            return safe_join(self.static_dir, "grc_cgcel_good.pdf")
+        return safe_join(self.static_dir, "grc_cgcel_all.pdf")
+
+    def get(self, report_type: str) -> PdfReader:
+        template_path = self.path(report_type)
+        mtime = self._mtime(template_path)
+        cached = self._templates.get(template_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(template_path, "rb") as f:
+            template_pdf = PdfReader(io.BytesIO(f.read()))
+        # Resolve every page now rather than on the first render
+        for page in template_pdf.pages:
+            page.get_contents()
+        self._templates[template_path] = (mtime, template_pdf)
+        return template_pdf
+
+    def template_hash(self, report_type: str) -> str:
+        # sha256 of the template file, part of the report store key. Called
+        # on the event loop, so it never parses: a stat while the mtime is
+        # unchanged, and a raw read of the file when it has changed.
+        template_path = self.path(report_type)
+        mtime = self._mtime(template_path)
+        cached = self._hashes.get(template_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(template_path, "rb") as f:
+            template_hash = hashlib.sha256(f.read()).hexdigest()
+        self._hashes[template_path] = (mtime, template_hash)
+        return template_hash
+
+    def _mtime(self, template_path: str) -> int:
+        try:
+            return os.stat(template_path).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Template PDF not found at {template_path}")
+
+
+grc_templates = GRCTemplateRegistry()
+
+
+# Table columns per report type: (field, x_start, x_end)
+GRC_REPORT_COLUMNS = {
+    "Defective": (
+        ("grc_number", 15, 80),
+        ("grc_date", 80, 135),
+        ("spare_code", 135, 240),
+        ("spare_description", 240, 545),
+        ("defective_qty", 545, 580),
+    ),
+    "Good": (
+        ("grc_number", 15, 80),
+        ("grc_date", 80, 135),
+        ("spare_code", 135, 240),
+        ("spare_description", 240, 545),
+        ("good_qty", 545, 580),
+    ),
+    "All": (
+        ("grc_number", 15, 80),
+        ("grc_date", 80, 135),
+        ("spare_code", 135, 240),
+        ("spare_description", 240, 467),
+        ("actual_pending_qty", 467, 510),
+        ("good_qty", 510, 545),
+        ("defective_qty", 545, 580),
+    ),
+}
+# Quantities a line must have (summed, > 0) to appear on each report type
+GRC_REPORT_QUANTITIES = {
+    "Defective": ("defective_qty",),
+    "Good": ("good_qty",),
+    "All": ("good_qty", "defective_qty"),
+}
+# Row slots between the table header and the footer: 28 lines, then the
+# page total, then (last page only) the challan total
+GRC_REPORT_ROWS_PER_PAGE = 28
+GRC_REPORT_FIRST_ROW_Y = 660
+GRC_REPORT_ROW_HEIGHT = 19
+
+
+def render_grc_report(
+    report_type: str, data: dict, username: str, output_path: str
+) -> int:
+    # Plain function of plain arguments, so it can run in a worker process.
+    # Writes the PDF to output_path and returns its page count.
+    columns = GRC_REPORT_COLUMNS.get(report_type, GRC_REPORT_COLUMNS["All"])
+    qty_fields = [field for field, _, _ in columns if field.endswith("_qty")]
+    rows = data.get("grc_rows") or []
+    pages = [
+        rows[start : start + GRC_REPORT_ROWS_PER_PAGE]
+        for start in range(0, len(rows), GRC_REPORT_ROWS_PER_PAGE)
+    ] or [[]]
+
+    def draw_centered(can, text, x_start, x_end, y, font="Helvetica", size=9):
+        text = "" if text is None else str(text)
+        can.setFont(font, size)
+        text_width = can.stringWidth(text, font, size)
+        x_mid = x_start + (x_end - x_start) / 2
+        can.drawString(x_mid - text_width / 2, y, text)
+
+    def draw_header(can):
+        can.setFont("Helvetica-Bold", 10)
+        can.drawString(88, 740, f"{data.get('challan_number', '')}")
+        # Reprints carry the stored challan date; new challans print today
+        can.drawString(
+            250, 740, data.get("challan_date") or date.today().strftime("%d-%m-%Y")
+        )
+        can.drawString(476, 740, f"{data.get('division', '')}")
+        can.drawString(476, 704, f"{data.get('docket_number', '')}")
+        can.drawString(144, 704, f"{data.get('sent_through', '')}")
+        can.drawString(474, 36, f"{username}")
+
+    def draw_totals(can, label, totals, y):
+        # Label sits in the description column, sums under their columns
+        for field, x_start, x_end in columns:
+            if field == "spare_description":
+                draw_centered(can, label, x_start, x_end, y, "Helvetica-Bold")
+            elif field in totals:
+                draw_centered(can, totals[field], x_start, x_end, y, "Helvetica-Bold")
+
+    challan_totals = dict.fromkeys(qty_fields, 0)
+
+    def overlay_page(page_number, page_rows):
+        # One page per canvas, so the overlay is built a page at a time
+        # instead of as one document-sized buffer
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=A4)
+        draw_header(can)
+        page_totals = dict.fromkeys(qty_fields, 0)
+        y = GRC_REPORT_FIRST_ROW_Y
+        for item in page_rows:
+            for field, x_start, x_end in columns:
+                value = item.get(field)
+                if field in page_totals:
+                    value = value or 0
+                    page_totals[field] += value
+                draw_centered(can, value, x_start, x_end, y)
+            y -= GRC_REPORT_ROW_HEIGHT
+
+        y = GRC_REPORT_FIRST_ROW_Y - GRC_REPORT_ROWS_PER_PAGE * GRC_REPORT_ROW_HEIGHT
+        if len(pages) == 1:
+            draw_totals(can, "Total", page_totals, y)
+        else:
+            draw_totals(can, "Page Total", page_totals, y)
+            for field in qty_fields:
+                challan_totals[field] += page_totals[field]
+            if page_number == len(pages):
+                draw_totals(
+                    can, "Challan Total", challan_totals, y - GRC_REPORT_ROW_HEIGHT
+                )
+            can.setFont("Helvetica", 9)
+            can.drawString(32, 36, f"Page {page_number} of {len(pages)}")
+        can.showPage()
+        can.save()
+        packet.seek(0)
+        return PdfReader(packet).pages[0]
+
+    template_pdf = grc_templates.get(report_type)
+
+    # One template page per overlay page; a multi-page template keeps its
+    # extra pages. Each output page is a blank page with the template and
+    # then the overlay merged in, and only then added to the writer: merging
+    # into a page the writer already owns leaves the overlay's font
+    # references pointing at the writer's own objects (PyPDF2 3.0), and the
+    # cached template pages are never modified either way. PyPDF2 keeps the whole output
+    # document in the writer until write(), so this worker process holds
+    # one document; the web worker only ever streams the finished file.
+    writer = PdfWriter()
+    page_count = max(len(pages), len(template_pdf.pages))
+    overlay = None
+    for i in range(page_count):
+        if i < len(pages):
+            overlay = overlay_page(i + 1, pages[i])
+        template_page = template_pdf.pages[min(i, len(template_pdf.pages) - 1)]
+        page = PageObject.create_blank_page(
+            width=template_page.mediabox.width, height=template_page.mediabox.height
+        )
+        page.merge_page(template_page)
+        page.merge_page(overlay)
+        writer.add_page(page)
+
+    # Straight to disk; the web worker streams the file back in chunks
+    with open(output_path, "wb") as output_stream:
+        writer.write(output_stream)
+    return page_count
+
+
+def _timed_render(
+    report_type: str, data: dict, username: str, output_path: str
+) -> float:
+    started = time.perf_counter()
+    render_grc_report(report_type, data, username, output_path)
+    return time.perf_counter() - started
+
+
+def discard_report(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def stream_report(path: str) -> AsyncIterator[bytes]:
+    # Chunks of a rendered report; the spooled file is removed afterwards
+    try:
+        with open(path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, GRC_REPORT_CHUNK_SIZE):
+                yield chunk
+    finally:
+        discard_report(path)
+
+
+def copy_report(path: str) -> str:
+    # A spooled copy of a report kept elsewhere (the report store), for the
+    # helpers here that remove the files they are given
+    os.makedirs(GRC_REPORT_SPOOL_DIR, exist_ok=True)
+    fd, output_path = tempfile.mkstemp(suffix=".pdf", dir=GRC_REPORT_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as dst, open(path, "rb") as src:
+            shutil.copyfileobj(src, dst)
+    except BaseException:
+        discard_report(output_path)
+        raise
+    return output_path
+
+
+def merge_reports(paths: List[str]) -> str:
+    # One PDF of all parts in order, spooled to disk; the parts are removed
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    fd, output_path = tempfile.mkstemp(suffix=".pdf", dir=GRC_REPORT_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as output_stream:
+        writer.write(output_stream)
+    for path in paths:
+        discard_report(path)
+    return output_path
+
+
+class _ZipSink:
+    # Write-only target for zipfile; without tell() zipfile writes a
+    # streamable archive (data descriptors after each entry)
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_report_zip(
+    parts: AsyncIterator[Tuple[str, str]]
+) -> AsyncIterator[bytes]:
+    # ZIP of (name, path) parts, sent entry by entry as parts arrive. PDFs
+    # are already compressed, so entries are stored as is.
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        async for name, path in parts:
+            try:
+                with open(path, "rb") as src, archive.open(name, "w") as dst:
+                    while chunk := await asyncio.to_thread(
+                        src.read, GRC_REPORT_CHUNK_SIZE
+                    ):
+                        dst.write(chunk)
+                        if data := sink.drain():
+                            yield data
+            finally:
+                discard_report(path)
+            if data := sink.drain():
+                yield data
+    # Central directory
+    yield sink.drain()
+
+
+class GRCReportRenderer:
+    """
+    Renders GRC report PDFs off the event loop.
+
+    ReportLab drawing and PyPDF2 merging are CPU bound, so they run in a
+    process pool of GRC_REPORT_WORKERS processes (a thread pool when 0). The
+    pool is started on first use and rebuilt if a worker process dies. Its
+    processes come from a forkserver, never a fork of the web worker, which
+    by then runs threads whose locks a forked child could inherit held.
+    """
+
+    def __init__(self, workers: int = GRC_REPORT_WORKERS):
+        self.workers = workers
+        self._pool: Optional[Executor] = None
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.rendered = 0
+        self.failed = 0
+        self.render_seconds = 0.0
+        self.max_render_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    async def render(self, report_type: str, data: dict, username: str) -> str:
+        # Returns the path of the rendered PDF in GRC_REPORT_SPOOL_DIR; the
+        # caller owns the file (see stream_report)
+        os.makedirs(GRC_REPORT_SPOOL_DIR, exist_ok=True)
+        fd, output_path = tempfile.mkstemp(suffix=".pdf", dir=GRC_REPORT_SPOOL_DIR)
+        os.close(fd)
+
+        self.in_flight += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        started = time.perf_counter()
+        job: Optional[Future] = None
+        try:
+            job = self._executor().submit(
+                _timed_render, report_type, data, username, output_path
+            )
+            render_seconds = await asyncio.wrap_future(job)
+        except BaseException as exc:
+            if isinstance(exc, BrokenProcessPool):
+                self._pool = None
+            self.failed += 1
+            if job is None:
+                discard_report(output_path)
+            else:
+                # Cancelling only stops a job not yet started; a running one
+                # still writes output_path, so remove it once the job ends
+                job.add_done_callback(lambda _: discard_report(output_path))
+            raise
+        finally:
+            self.in_flight -= 1
+
+        self.rendered += 1
+        self.render_seconds += render_seconds
+        self.max_render_seconds = max(self.max_render_seconds, render_seconds)
+        self.wait_seconds += time.perf_counter() - started - render_seconds
+        return output_path
+
+    @property
+    def queue_depth(self) -> int:
+        # Renders submitted but not yet picked up by a worker
+        return max(0, self.in_flight - max(self.workers, 1))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "avg_render_seconds": (
+                self.render_seconds / self.rendered if self.rendered else 0.0
+            ),
+            "max_render_seconds": self.max_render_seconds,
+            "avg_wait_seconds": (
+                self.wait_seconds / self.rendered if self.rendered else 0.0
+            ),
+        }
+
+    def _executor(self) -> Executor:
+        if self._pool is None:
+            if self.workers > 0:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(thread_name_prefix="grc-report")
+        return self._pool
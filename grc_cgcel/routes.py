@@ -1,14 +1,38 @@
+import asyncio
 import token
 from datetime import date
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
-from fastapi.responses import JSONResponse, StreamingResponse
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from auth.dependencies import AccessTokenBearer, RoleChecker
 from db.db import get_session
+from grc_cgcel.jobs import GRCUploadJobManager
+from grc_cgcel.report import GRC_REPORT_COLUMNS
 from grc_cgcel.schemas import (
+    GRCBatchPrintPayload,
+    GRCReportStorePayload,
     GRCCGCELReceiveSchema,
     GRCCGCELReturnSave,
     GRCCGCELReturnSchema,
@@ -17,16 +41,61 @@ from grc_cgcel.schemas import (
     GRCCGCELReturnFinalizePayload,
     GRCCGCELEnquiry,
 )
-from grc_cgcel.service import GRCCGCELService
+from grc_cgcel.service import (
+    GRC_BATCH_PRINT_OUTPUTS,
+    GRC_EXPORT_FORMATS,
+    GRC_SCOPE_RECEIVE,
+    GRC_SCOPE_UPLOAD,
+    GRCCGCELService,
+    GRCVersionConflict,
+)
 
 grc_cgcel_router = APIRouter()
 grc_cgcel_service = GRCCGCELService()
+grc_upload_jobs = GRCUploadJobManager(grc_cgcel_service)
 access_token_bearer = AccessTokenBearer()
 role_checker = Depends(RoleChecker(allowed_roles=["ADMIN"]))
 
 
+def rows_response(content) -> Response:
+    # Read paths return plain dicts already in response schema shape; encode
+    # them once instead of re-validating every row through response_model
+    if orjson is not None:
+        return Response(content=orjson.dumps(content), media_type="application/json")
+    return JSONResponse(content=content)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def tagged_response(response: Response, etag: str) -> Response:
+    # Clients keep the body but revalidate with If-None-Match every time
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def version_conflict_response(exc: GRCVersionConflict) -> JSONResponse:
+    return JSONResponse(
+        content={
+            "message": "GRC rows changed by another user",
+            "resolution": "Reload the sheet and apply your changes again",
+            "type": "warning",
+            "conflicts": exc.conflicts,
+        },
+        status_code=status.HTTP_409_CONFLICT,
+    )
+
+
 """
-Upload GRC CGCEL data via CSV file.
+Upload GRC CGCEL data via CSV or .xlsx file.
+engine: buffered | stream | copy, or auto to pick by file size.
+background=true queues the file and returns a job id to poll.
 """
 
 
@@ -38,10 +107,21 @@ Upload GRC CGCEL data via CSV file.
 async def upload_grc_cgcel(
     session: AsyncSession = Depends(get_session),
     file: UploadFile = File(...),
-    _=Depends(access_token_bearer),
+    engine: str = "auto",
+    background: bool = False,
+    token=Depends(access_token_bearer),
 ):
+    if background:
+        job = await grc_upload_jobs.submit(file, engine, token)
+        return JSONResponse(
+            content={"job_id": job["job_id"], "status": job["status"]},
+            status_code=status.HTTP_202_ACCEPTED,
+        )
+
     try:
-        result = await grc_cgcel_service.upload_grc_cgcel(session, file)
+        result = await grc_cgcel_service.upload_grc_cgcel(
+            session, file, engine, token
+        )
     except Exception as exc:
         return JSONResponse(
             content={
@@ -65,6 +145,28 @@ async def upload_grc_cgcel(
     )
 
 
+"""
+Progress of a background GRC upload.
+"""
+
+
+@grc_cgcel_router.get(
+    "/upload/{job_id}",
+    status_code=status.HTTP_200_OK,
+    dependencies=[role_checker],
+)
+async def upload_grc_cgcel_status(
+    job_id: str,
+    _=Depends(access_token_bearer),
+):
+    job = grc_upload_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload job not found"
+        )
+    return job
+
+
 """
 GRC Numbers not received yet.
 """
@@ -76,11 +178,15 @@ GRC Numbers not received yet.
     status_code=status.HTTP_200_OK,
 )
 async def not_received_grc(
+    request: Request,
     session: AsyncSession = Depends(get_session),
     _=Depends(access_token_bearer),
 ):
-    result = await grc_cgcel_service.not_received_grc_numbers(session)
-    return result
+    etag = await grc_cgcel_service.change_tag(session, [GRC_SCOPE_RECEIVE])
+    if etag_matches(request, etag):
+        return tagged_response(Response(status_code=status.HTTP_304_NOT_MODIFIED), etag)
+    result = await grc_cgcel_service.not_received_grc_numbers(session, etag)
+    return tagged_response(rows_response(result), etag)
 
 
 """
@@ -95,11 +201,15 @@ Not received details by grc number
 )
 async def not_received_by_grc_number(
     grc_number: int,
+    request: Request,
     session: AsyncSession = Depends(get_session),
     _=Depends(access_token_bearer),
 ):
+    etag = await grc_cgcel_service.change_tag(session, [GRC_SCOPE_RECEIVE])
+    if etag_matches(request, etag):
+        return tagged_response(Response(status_code=status.HTTP_304_NOT_MODIFIED), etag)
     result = await grc_cgcel_service.not_received_by_grc_number(grc_number, session)
-    return result
+    return tagged_response(rows_response(result), etag)
 
 
 """
@@ -116,8 +226,13 @@ async def update_grc_cgcel_receive(
     session: AsyncSession = Depends(get_session),
     _=Depends(access_token_bearer),
 ):
-    await grc_cgcel_service.update_cgcel_grc_receive(data, session)
-    return JSONResponse(content={"message": f"GRC Receive Details Updated"})
+    try:
+        result = await grc_cgcel_service.update_cgcel_grc_receive(data, session)
+    except GRCVersionConflict as exc:
+        return version_conflict_response(exc)
+    return JSONResponse(
+        content={"message": f"GRC Receive Details Updated", **result}
+    )
 
 
 """
@@ -132,11 +247,17 @@ Get GRC Return by Division
 )
 async def grc_return_by_division(
     division: str,
+    request: Request,
     session: AsyncSession = Depends(get_session),
     _=Depends(access_token_bearer),
 ):
-    result = await grc_cgcel_service.grc_return_by_division(division, session)
-    return result
+    etag = await grc_cgcel_service.change_tag(
+        session, [GRC_SCOPE_UPLOAD, grc_cgcel_service.return_scope(division)]
+    )
+    if etag_matches(request, etag):
+        return tagged_response(Response(status_code=status.HTTP_304_NOT_MODIFIED), etag)
+    result = await grc_cgcel_service.grc_return_by_division(division, session, etag)
+    return tagged_response(rows_response(result), etag)
 
 
 """
@@ -153,8 +274,11 @@ async def save_grc_cgcel_return(
     session: AsyncSession = Depends(get_session),
     _=Depends(access_token_bearer),
 ):
-    await grc_cgcel_service.save_cgcel_grc_return(data, session)
-    return JSONResponse(content={"message": f"GRC Return Details Saved"})
+    try:
+        result = await grc_cgcel_service.save_cgcel_grc_return(data, session)
+    except GRCVersionConflict as exc:
+        return version_conflict_response(exc)
+    return JSONResponse(content={"message": f"GRC Return Details Saved", **result})
 
 
 """
@@ -171,12 +295,20 @@ async def finalize_grc_cgcel_return(
     session: AsyncSession = Depends(get_session),
     token=Depends(access_token_bearer),
 ):
-    await grc_cgcel_service.finalize_cgcel_grc_return(data, session, token)
-    return JSONResponse(content={"message": f"GRC Return Details Finalized"})
+    try:
+        result = await grc_cgcel_service.finalize_cgcel_grc_return(
+            data, session, token
+        )
+    except GRCVersionConflict as exc:
+        return version_conflict_response(exc)
+    return JSONResponse(
+        content={"message": f"GRC Return Details Finalized", **result}
+    )
 
 
 """
-Get the next available challan code.
+Get the next available challan code. This is a preview: print challans with the
+challan_number returned by finalize_grc_return, which is the one allocated.
 """
 
 
@@ -215,8 +347,144 @@ async def print_grc_report(
     )
 
 """
-GRC CGCEL enquiry using query parameters.
+Reprint a finalized challan. Served from the report store when it already
+holds this challan and template, rendered from return history otherwise.
+"""
+
+
+@grc_cgcel_router.get(
+    "/challan_report/{challan_number}/{report_type}",
+    status_code=status.HTTP_200_OK,
+)
+async def challan_report(
+    challan_number: str,
+    report_type: str,
+    session: AsyncSession = Depends(get_session),
+    _=Depends(access_token_bearer),
+):
+    if report_type not in GRC_REPORT_COLUMNS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid report type '{report_type}', expected Good, Defective or All",
+        )
+    challan_number = grc_cgcel_service.normalise_challan_number(challan_number)
+    path = await grc_cgcel_service.challan_report(session, challan_number, report_type)
+    if path is None:
+        return JSONResponse(
+            content={
+                "message": "Challan not found",
+                "resolution": f"No return history for {challan_number}",
+                "type": "warning",
+            },
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return FileResponse(
+        path,
+        media_type="application/pdf",
+        filename=f"{challan_number}_{report_type}.pdf",
+    )
+
+
+"""
+Render challans into the report store ahead of printing (all report types,
+at most 100 challans per request).
+"""
+
+
+@grc_cgcel_router.post(
+    "/report_store/prewarm",
+    status_code=status.HTTP_200_OK,
+    dependencies=[role_checker],
+)
+async def prewarm_report_store(
+    data: GRCReportStorePayload,
+    _=Depends(access_token_bearer),
+):
+    try:
+        challan_numbers = grc_cgcel_service.prewarm_challan_numbers(
+            data.challan_numbers
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    return await grc_cgcel_service.prewarm_challan_reports(challan_numbers)
 
+
+"""
+Remove stored challan PDFs, for the given challans or all of them.
+"""
+
+
+@grc_cgcel_router.delete(
+    "/report_store",
+    status_code=status.HTTP_200_OK,
+    dependencies=[role_checker],
+)
+async def purge_report_store(
+    challan_numbers: Optional[List[str]] = Query(None),
+    _=Depends(access_token_bearer),
+):
+    if challan_numbers:
+        challan_numbers = [
+            grc_cgcel_service.normalise_challan_number(number)
+            for number in challan_numbers
+        ]
+    return await asyncio.to_thread(
+        grc_cgcel_service.report_store.purge, challan_numbers
+    )
+
+
+"""
+Print several finalized challans at once from return history.
+Jobs are (challan_number, report_type) pairs; output=zip streams each PDF as
+it is rendered, output=pdf returns one concatenated PDF.
+"""
+
+
+@grc_cgcel_router.post(
+    "/print_batch",
+    status_code=status.HTTP_200_OK,
+)
+async def print_grc_batch(
+    data: GRCBatchPrintPayload,
+    session: AsyncSession = Depends(get_session),
+    _=Depends(access_token_bearer),
+):
+    try:
+        jobs = grc_cgcel_service.batch_print_jobs(data.jobs, data.output)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    challans = await grc_cgcel_service.challan_report_data(
+        session, sorted({job.challan_number for job in jobs})
+    )
+    missing = sorted({job.challan_number for job in jobs} - set(challans))
+    if missing:
+        return JSONResponse(
+            content={
+                "message": "Challan not found",
+                "resolution": f"No return history for {', '.join(missing)}",
+                "type": "warning",
+            },
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+
+    return StreamingResponse(
+        grc_cgcel_service.print_challan_batch(jobs, challans, data.output),
+        media_type=GRC_BATCH_PRINT_OUTPUTS[data.output],
+        headers={
+            "Content-Disposition": f'attachment; filename="grc_challans.{data.output}"'
+        },
+    )
+
+
+"""
+GRC CGCEL enquiry using query parameters.
+Pass the returned next_cursor back as cursor for the following page;
+total_records is only reported on the first page. approximate=true allows
+a planner estimate (total_is_estimate) for very large result sets.
+match selects how spare_code is searched: exact (default), prefix,
+substring or fuzzy. prefix/substring/fuzzy also search spare_description
+and rank results by similarity.
 """
 
 
@@ -234,11 +502,14 @@ async def enquiry_grc_cgcel(
     grc_status: Optional[str] = "N",
     limit: int = 100,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    approximate: bool = False,
+    match: str = "exact",
     session: AsyncSession = Depends(get_session),
     _=Depends(access_token_bearer),
 ):
     try:
-        result, total_records = await grc_cgcel_service.enquiry_grc_cgcel(
+        enquiry = await grc_cgcel_service.enquiry_grc_cgcel(
             session,
             division,
             spare_code,
@@ -250,7 +521,105 @@ async def enquiry_grc_cgcel(
             limit,
             offset,
             return_total=True,
+            cursor=cursor,
+            approximate=approximate,
+            match=match,
         )
-        return {"records": result, "total_records": total_records}
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
     except Exception as exc:
-        return {"records": [], "total_records": 0}
+        return {
+            "records": [],
+            "total_records": 0,
+            "total_is_estimate": False,
+            "next_cursor": None,
+        }
+    return rows_response(enquiry)
+
+
+"""
+Read cache counters for this worker (hits, misses, evictions, ...).
+"""
+
+
+@grc_cgcel_router.get(
+    "/cache_stats",
+    status_code=status.HTTP_200_OK,
+    dependencies=[role_checker],
+)
+async def grc_cache_stats(_=Depends(access_token_bearer)):
+    return grc_cgcel_service.read_cache.stats()
+
+
+"""
+Report rendering counters for this worker (queue depth, render times).
+"""
+
+
+@grc_cgcel_router.get(
+    "/report_stats",
+    status_code=status.HTTP_200_OK,
+    dependencies=[role_checker],
+)
+async def grc_report_stats(_=Depends(access_token_bearer)):
+    stats = grc_cgcel_service.report_renderer.stats()
+    stats["store"] = grc_cgcel_service.report_store.stats()
+    return stats
+
+
+"""
+Export GRC CGCEL enquiry results as CSV or NDJSON (format=csv|ndjson).
+Takes the same filters as /enquiry and streams every matching row.
+"""
+
+
+@grc_cgcel_router.get(
+    "/enquiry/export",
+    status_code=status.HTTP_200_OK,
+)
+async def export_grc_cgcel_enquiry(
+    division: Optional[str] = None,
+    spare_code: Optional[str] = None,
+    from_grc_date: Optional[date] = None,
+    to_grc_date: Optional[date] = None,
+    grc_number: Optional[str] = None,
+    challan_number: Optional[str] = None,
+    grc_status: Optional[str] = "N",
+    match: str = "exact",
+    export_format: str = Query("csv", alias="format"),
+    _=Depends(access_token_bearer),
+):
+    if export_format not in GRC_EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid format '{export_format}', expected csv or ndjson",
+        )
+    try:
+        statement = grc_cgcel_service.enquiry_export_statement(
+            division,
+            spare_code,
+            from_grc_date,
+            to_grc_date,
+            grc_number,
+            challan_number,
+            grc_status,
+            match,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    async def export_rows():
+        # The session lives as long as the stream, not the request handler
+        async for session in get_session():
+            async for chunk in grc_cgcel_service.stream_enquiry_export(
+                session, statement, export_format
+            ):
+                yield chunk
+
+    return StreamingResponse(
+        export_rows(),
+        media_type=GRC_EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="grc_cgcel_enquiry.{export_format}"'
+        },
+    )
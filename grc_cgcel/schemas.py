@@ -26,6 +26,7 @@ class GRCCGCELReceiveSchema(BaseModel):
     alt_spare_qty: Optional[int]
     alt_spare_code: Optional[str]
     dispute_remark: Optional[str]
+    version: Optional[int] = None
 
 
 class GRCCGCELUpdateReceiveSchema(BaseModel):
@@ -37,6 +38,7 @@ class GRCCGCELUpdateReceiveSchema(BaseModel):
     alt_spare_qty: Optional[int]
     alt_spare_code: Optional[str]
     dispute_remark: Optional[str]
+    version: Optional[int] = None
 
 
 class GRCCGCELDisputeCreate(BaseModel):
@@ -68,6 +70,7 @@ class GRCCGCELReturnSchema(BaseModel):
     invoice: Optional[str]
     docket_number: Optional[str]
     sent_through: Optional[str]
+    version: Optional[int] = None
 
 
 class GRCCGCELReturnSave(BaseModel):
@@ -78,15 +81,17 @@ class GRCCGCELReturnSave(BaseModel):
     invoice: str
     sent_through: Optional[str]
     docket_number: Optional[str]
+    version: Optional[int] = None
 
 class GRCCGCELFinalizeRow(BaseModel):
     spare_code: str
     grc_number: int
     good_qty: Optional[int]
     defective_qty: Optional[int]
+    version: Optional[int] = None
 
 class GRCCGCELReturnFinalizePayload(BaseModel):
-    challan_number: str
+    challan_number: Optional[str] = None
     division: str
     sent_through: Optional[str]
     docket_number: Optional[str]
@@ -111,6 +116,20 @@ class GRCFullPayload(BaseModel):
     grc_rows: List[GRCRowPayload]
 
 
+class GRCBatchPrintJob(BaseModel):
+    challan_number: str
+    report_type: str
+
+
+class GRCBatchPrintPayload(BaseModel):
+    jobs: List[GRCBatchPrintJob]
+    output: str = "zip"
+
+
+class GRCReportStorePayload(BaseModel):
+    challan_numbers: List[str]
+
+
 class GRCCGCELHistorySchema(BaseModel):
     division: str
     spare_code: str
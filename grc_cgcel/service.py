@@ -1,23 +1,70 @@
+import asyncio
+import base64
+import codecs
 import csv
+import hashlib
 import io
+import json
 import os
-from datetime import date
-from typing import List, Optional
+import traceback
+from collections import deque
+from datetime import date, datetime
+from itertools import islice
+from typing import AsyncIterator, Callable, List, Optional
 
 from fastapi import UploadFile
-from pydantic import ValidationError
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase.pdfmetrics import stringWidth
-from reportlab.pdfgen import canvas
-from sqlalchemy import case, insert, tuple_, update, select, distinct
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import (
+    Boolean,
+    Float,
+    Integer,
+    String,
+    and_,
+    case,
+    cast,
+    column,
+    distinct,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import func
 
+from db.db import get_session
 from exceptions import SpareNotFound
-from grc_cgcel.models import GRCCGCEL, GRCCGCELDispute, GRCCGCELReturnHistory
+from grc_cgcel.cache import GRC_CACHE_CHANNEL, GRCReadCache
+from grc_cgcel.models import (
+    GRCCGCEL,
+    GRCCGCELChangeCounter,
+    GRCCGCELDispute,
+    GRCCGCELReturnHistory,
+    GRCCGCELUploadLedger,
+    grc_cgcel_challan_seq,
+    grc_cgcel_stage,
+    grc_cgcel_upload_keys,
+)
+from grc_cgcel.report import (
+    GRC_REPORT_COLUMNS,
+    GRC_REPORT_QUANTITIES,
+    GRCReportRenderer,
+    copy_report,
+    discard_report,
+    grc_templates,
+    merge_reports,
+    stream_report,
+    stream_report_zip,
+)
 from grc_cgcel.schemas import (
+    GRCBatchPrintJob,
     GRCCGCELDisputeCreate,
     GRCCGCELHistorySchema,
     GRCCGCELReceiveSchema,
@@ -29,149 +76,323 @@ from grc_cgcel.schemas import (
     GRCFullPayload,
     GRCCGCELEnquiry,
 )
+from grc_cgcel.store import GRCReportStore
 from utils.date_utils import format_date_ddmmyyyy
-from utils.file_utils import safe_join
 
+GRC_INT_FIELDS = frozenset({"grc_number", "grc_pending_qty", "issue_qty"})
+GRC_KEY_FIELDS = ("spare_code", "grc_number")
+GRC_HASH_FIELDS = (
+    "division",
+    "spare_description",
+    "grc_date",
+    "issue_qty",
+    "grc_pending_qty",
+)
+GRC_RECEIVE_FIELDS = (
+    "receive_qty",
+    "damaged_qty",
+    "short_qty",
+    "alt_spare_qty",
+    "alt_spare_code",
+    "dispute_remark",
+)
+GRC_RETURN_SAVE_FIELDS = (
+    "good_qty",
+    "defective_qty",
+    "invoice",
+    "sent_through",
+    "docket_number",
+)
+GRC_UPLOAD_CHUNK_SIZE = 1024 * 1024
+GRC_UPLOAD_BATCH_SIZE = 5000
+GRC_UPLOAD_ENGINES = ("buffered", "stream", "copy")
+GRC_EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+GRC_EXCEL_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+)
+# Thresholds used by engine="auto"; files without a known size stay buffered
+GRC_STREAM_MIN_BYTES = 8 * 1024 * 1024
+GRC_COPY_MIN_BYTES = 64 * 1024 * 1024
 
-class GRCCGCELService:
-    async def upload_grc_cgcel(self, session: AsyncSession, file: UploadFile):
-        content = await file.read()
-        try:
-            text = content.decode("utf-8-sig")
-        except Exception:
-            text = content.decode("utf-8", errors="ignore")
 
-        reader = csv.DictReader(io.StringIO(text))
+GRC_UPLOAD_MAX_ERRORS = 500
+# Enquiries estimated above this many rows report the planner's estimate
+# when approximate totals are requested
+GRC_APPROX_COUNT_MIN_ROWS = 50000
+# Spare search modes on enquiry. exact keeps the case-insensitive equality
+# match; the others search spare_code and spare_description through the
+# pg_trgm indexes and rank results by similarity.
+GRC_SPARE_MATCH_MODES = ("exact", "prefix", "substring", "fuzzy")
+# Enquiry export: media type per format, and rows fetched per server-side
+# cursor round trip
+GRC_EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+GRC_EXPORT_BATCH_SIZE = 2000
+GRC_ENQUIRY_FIELDS = tuple(GRCCGCELEnquiry.model_fields)
+GRC_ENQUIRY_DATE_FIELDS = ("grc_date", "challan_date")
+# Columns projected by the receive/return read paths, in schema order
+GRC_RECEIVE_VIEW_FIELDS = tuple(GRCCGCELReceiveSchema.model_fields)
+GRC_RETURN_VIEW_FIELDS = tuple(GRCCGCELReturnSchema.model_fields)
+# Change counter scopes (GRCCGCELChangeCounter). "receive" covers the
+# not-received reads, "upload" any bulk load, "return:<division>" the return
+# sheet of one division.
+GRC_SCOPE_RECEIVE = "receive"
+GRC_SCOPE_UPLOAD = "upload"
+# Batch printing: media type per output, and the most parts per request
+GRC_BATCH_PRINT_OUTPUTS = {"zip": "application/zip", "pdf": "application/pdf"}
+GRC_BATCH_PRINT_MAX_JOBS = 100
+# Most challans one report store prewarm request may render
+GRC_REPORT_PREWARM_MAX_CHALLANS = 100
+# Challan numbers each worker reserves per sequence call; 0 or 1 allocates
+# one number per finalize
+GRC_CHALLAN_RESERVE_BLOCK = int(os.getenv("GRC_CHALLAN_RESERVE_BLOCK", "0"))
+GRC_ROWS_ADAPTER = TypeAdapter(List[GRCCGCELSchema])
 
-        if not reader.fieldnames:
-            return {
-                "message": "Invalid file",
-                "resolution": "CSV file has no headers",
-                "type": "warning",
-            }
 
-        records = []
-        line_no = 1
+class GRCVersionConflict(Exception):
+    """Raised when GRC rows were changed by someone else since they were read."""
 
-        for raw_row in reader:
-            line_no += 1
+    def __init__(self, conflicts: List[dict]):
+        super().__init__(f"{len(conflicts)} GRC rows were changed by another user")
+        self.conflicts = conflicts
 
-            # Define which fields are numeric
-            int_fields = {"grc_number", "grc_pending_qty", "issue_qty"}
-            row = {}
-            for k, v in raw_row.items():
-                key = (k or "").strip().lower()
-                val = v.strip() if v else ""
-                if key in int_fields:
-                    row[key] = int(val) if val != "" else None
-                else:
-                    row[key] = val.upper() if val != "" else None
-
-            spare_code = row.get("spare_code")
-            division = row.get("division")
-            spare_description = row.get("spare_description")
-            grc_number = row.get("grc_number")
-            grc_date = row.get("grc_date")
-            issue_qty = row.get("issue_qty")
-            grc_pending_qty = row.get("grc_pending_qty")
-
-            try:
-                validated = GRCCGCELSchema(
-                    spare_code=spare_code,
-                    division=division,
-                    spare_description=spare_description,
-                    grc_number=grc_number,
-                    grc_date=grc_date,
-                    issue_qty=issue_qty,
-                    grc_pending_qty=grc_pending_qty,
-                    status="N",
-                )
-            except ValidationError as ve:
-                return {
-                    "message": f"Validation failed for {spare_code}",
-                    "resolution": str(ve),
-                    "type": "warning",
-                }
 
-            records.append(validated)
+class GRCRowConverter:
+    """
+    Converts raw CSV rows into GRCCGCELSchema input dicts.
+
+    Header positions are resolved once per file, so each row only touches the
+    columns the schema needs. Integer columns are parsed here when possible;
+    anything unparseable is left as text for validation to report.
+    """
 
-        if not records:
+    def __init__(self, header: List[str]):
+        positions = {}
+        for idx, column in enumerate(header):
+            field = (column or "").strip().lower()
+            if field in GRCCGCELSchema.model_fields:
+                positions[field] = idx
+
+        self.present_fields = set(positions) - set(GRC_KEY_FIELDS)
+        self._fields = tuple(GRCCGCELSchema.model_fields)
+        self._int_positions = [
+            (field, idx) for field, idx in positions.items() if field in GRC_INT_FIELDS
+        ]
+        self._str_positions = [
+            (field, idx)
+            for field, idx in positions.items()
+            if field not in GRC_INT_FIELDS
+        ]
+
+    def convert(self, values: List[str]) -> dict:
+        row = dict.fromkeys(self._fields)
+        width = len(values)
+        for field, idx in self._str_positions:
+            val = values[idx].strip() if idx < width else ""
+            if val:
+                row[field] = val.upper()
+        for field, idx in self._int_positions:
+            val = values[idx].strip() if idx < width else ""
+            if val:
+                try:
+                    row[field] = int(val)
+                except ValueError:
+                    row[field] = val
+        return row
+
+    def convert_batch(self, batch: List[List[str]]) -> List[dict]:
+        convert = self.convert
+        return [convert(values) for values in batch]
+
+
+class GRCCGCELService:
+    def __init__(self, challan_block_size: int = GRC_CHALLAN_RESERVE_BLOCK):
+        self.challan_block_size = challan_block_size
+        self._reserved_challans = deque()
+        self._challan_lock = asyncio.Lock()
+        self.read_cache = GRCReadCache()
+        self.report_renderer = GRCReportRenderer()
+        self.report_store = GRCReportStore()
+        self._prewarm_tasks = set()
+
+    async def upload_grc_cgcel(
+        self,
+        session: AsyncSession,
+        file: UploadFile,
+        engine: str = "auto",
+        token: Optional[dict] = None,
+        progress: Optional[Callable[[int], None]] = None,
+    ):
+        if engine == "auto":
+            engine = self._pick_upload_engine(file)
+
+        if engine not in GRC_UPLOAD_ENGINES:
             return {
-                "message": "Uploaded Successfully",
-                "resolution": "No valid rows found",
+                "message": "Invalid upload engine",
+                "resolution": f"Use one of {', '.join(GRC_UPLOAD_ENGINES)}",
+                "type": "warning",
             }
 
-        # Use (spare_code, grc_number) as composite key
-        from sqlalchemy import tuple_
+        # Re-uploading the file that was loaded last is a no-op
+        file_hash = await self._hash_upload(file)
+        last_upload = await self._last_grc_upload(session)
+        if last_upload and last_upload.file_hash == file_hash:
+            return {
+                "message": "File unchanged since last upload",
+                "resolution": (
+                    f"Inserted : 0, Updated : 0, Unchanged : {last_upload.row_count}"
+                ),
+                "type": "success",
+                "unchanged": last_upload.row_count,
+                "changed": 0,
+                "new": 0,
+            }
 
-        keys = [(r.spare_code, r.grc_number) for r in records]
+        if self._is_excel_upload(file):
+            rows = self._iter_xlsx_rows(file)
+        elif engine == "buffered":
+            rows = self._iter_buffered_rows(file)
+        else:
+            rows = self._iter_stream_rows(file)
 
-        result = await session.execute(
-            select(GRCCGCEL).where(
-                tuple_(GRCCGCEL.spare_code, GRCCGCEL.grc_number).in_(keys)
-            )
+        return await self._ingest_grc_rows(
+            session,
+            rows,
+            use_copy=engine == "copy",
+            file_name=file.filename,
+            file_hash=file_hash,
+            token=token,
+            progress=progress,
         )
-        existing = {(r.spare_code, r.grc_number): r for r in result.scalars().all()}
 
-        to_insert = []
-        to_update = {}
+    def _pick_upload_engine(self, file: UploadFile) -> str:
+        size = getattr(file, "size", None) or 0
+        if size >= GRC_COPY_MIN_BYTES:
+            return "copy"
+        if size >= GRC_STREAM_MIN_BYTES:
+            return "stream"
+        return "buffered"
 
-        # Determine which columns are present in the CSV (excluding spare_code and grc_number)
-        present_fields = set()
-        for r in records:
-            present_fields.update(r.dict(exclude_unset=True).keys())
-        present_fields.discard("spare_code")
-        present_fields.discard("grc_number")
+    async def _ingest_grc_rows(
+        self,
+        session: AsyncSession,
+        rows,
+        use_copy: bool = False,
+        file_name: Optional[str] = None,
+        file_hash: Optional[str] = None,
+        token: Optional[dict] = None,
+        progress: Optional[Callable[[int], None]] = None,
+        batch_size: int = GRC_UPLOAD_BATCH_SIZE,
+    ):
+        # Rows are validated and written batch by batch inside one transaction,
+        # so memory stays bounded by the batch size. With use_copy the batches
+        # are COPYed into a staging table and merged into grc_cgcel with a
+        # single statement at the end.
+        header = None
+        async for fields in rows:
+            if fields:
+                header = fields
+                break
 
-        for r in records:
-            # Only include fields present in the CSV (plus spare_code, grc_number), and set status='N'
-            data_dict = {
-                k: v
-                for k, v in r.dict(exclude_unset=False).items()
-                if k in ("spare_code", "grc_number") or k in present_fields
+        if not header:
+            return {
+                "message": "Invalid file",
+                "resolution": "CSV file has no headers",
+                "type": "warning",
             }
-            data_dict["status"] = "N"
-            key = (r.spare_code, r.grc_number)
-            if key in existing:
-                to_update[key] = data_dict
-            else:
-                to_insert.append(data_dict)
 
-        inserted = 0
-        updated = 0
+        converter = GRCRowConverter(header)
+        present_fields = converter.present_fields
 
-        table = GRCCGCEL.__table__
+        counts = dict.fromkeys(
+            ("inserted", "updated", "unchanged", "changed", "new"), 0
+        )
+        errors = []
+        row_count = 0
+        batch = []
 
         try:
-            await session.execute(update(table).values(status="Y"))
-
-            if to_insert:
-                await session.execute(insert(table).values(to_insert))
-                inserted = len(to_insert)
-
-            if to_update:
-                # Only update fields present in the CSV (excluding spare_code, grc_number)
-                update_fields = present_fields.copy()
-                update_fields.add("status")
-                for key, values in to_update.items():
-                    stmt = (
-                        update(table)
-                        .where(
-                            (table.c.spare_code == key[0])
-                            & (table.c.grc_number == key[1])
-                        )
-                        .values(
-                            **{
-                                field: values[field]
-                                for field in update_fields
-                                if field in values
-                            }
-                        )
+            await self._create_temp_table(session, grc_cgcel_upload_keys)
+            if use_copy:
+                await self._create_temp_table(session, grc_cgcel_stage)
+
+            async for values in rows:
+                if not values:
+                    continue
+                batch.append(values)
+                row_count += 1
+
+                if len(batch) >= batch_size:
+                    await self._flush_grc_batch(
+                        session,
+                        converter.convert_batch(batch),
+                        row_count - len(batch),
+                        present_fields,
+                        use_copy,
+                        counts,
+                        errors,
                     )
-                    await session.execute(stmt)
-                updated = len(to_update)
+                    batch = []
+                    if progress:
+                        progress(row_count)
+
+            if batch:
+                await self._flush_grc_batch(
+                    session,
+                    converter.convert_batch(batch),
+                    row_count - len(batch),
+                    present_fields,
+                    use_copy,
+                    counts,
+                    errors,
+                )
+                if progress:
+                    progress(row_count)
+
+            if errors:
+                await session.rollback()
+                first = errors[0]
+                return {
+                    "message": (
+                        f"Validation failed for {first['spare_code']}"
+                        if len(errors) == 1
+                        else f"Validation failed for {len(errors)} rows"
+                    ),
+                    "resolution": (
+                        f"Line {first['line']}, {first['field']}: {first['error']}"
+                    ),
+                    "type": "warning",
+                    "errors": errors,
+                }
+
+            if not row_count:
+                await session.rollback()
+                return {
+                    "message": "Uploaded Successfully",
+                    "resolution": "No valid rows found",
+                }
+
+            if use_copy and counts["changed"] + counts["new"]:
+                counts["inserted"], counts["updated"] = await self._merge_grc_stage(
+                    session, present_fields
+                )
 
+            await self._reconcile_grc_status(session)
+            scopes = [GRC_SCOPE_RECEIVE, GRC_SCOPE_UPLOAD]
+            await self._bump_change_counters(session, scopes)
+            session.add(
+                GRCCGCELUploadLedger(
+                    file_name=file_name,
+                    file_hash=file_hash,
+                    row_count=row_count,
+                    inserted=counts["inserted"],
+                    updated=counts["updated"],
+                    unchanged=counts["unchanged"],
+                    uploaded_by=token["user"]["username"] if token else None,
+                    uploaded_at=datetime.now(),
+                )
+            )
             await session.commit()
+            self.read_cache.invalidate(scopes)
 
         except IntegrityError as e:
             await session.rollback()
@@ -193,11 +414,362 @@ class GRCCGCELService:
 
         return {
             "message": "Spare Code Uploaded",
-            "resolution": f"Inserted : {inserted}, Updated : {updated}",
+            "resolution": (
+                f"Inserted : {counts['inserted']}, Updated : {counts['updated']}, "
+                f"Unchanged : {counts['unchanged']}"
+            ),
             "type": "success",
+            "unchanged": counts["unchanged"],
+            "changed": counts["changed"],
+            "new": counts["new"],
         }
 
-    async def not_received_grc_numbers(self, session: AsyncSession):
+    async def _hash_upload(
+        self, file: UploadFile, chunk_size: int = GRC_UPLOAD_CHUNK_SIZE
+    ) -> str:
+        digest = hashlib.sha256()
+        while chunk := await file.read(chunk_size):
+            digest.update(chunk)
+        await file.seek(0)
+        return digest.hexdigest()
+
+    async def _last_grc_upload(self, session: AsyncSession):
+        result = await session.execute(
+            select(GRCCGCELUploadLedger)
+            .order_by(GRCCGCELUploadLedger.id.desc())
+            .limit(1)
+        )
+        return result.scalars().first()
+
+    async def _iter_buffered_rows(self, file: UploadFile):
+        content = await file.read()
+        try:
+            text = content.decode("utf-8-sig")
+        except Exception:
+            text = content.decode("utf-8", errors="ignore")
+
+        for fields in csv.reader(io.StringIO(text)):
+            yield fields
+
+    def _is_excel_upload(self, file: UploadFile) -> bool:
+        filename = (file.filename or "").lower()
+        return filename.endswith(GRC_EXCEL_EXTENSIONS) or (
+            file.content_type == GRC_EXCEL_CONTENT_TYPE
+        )
+
+    async def _iter_xlsx_rows(
+        self, file: UploadFile, batch_size: int = GRC_UPLOAD_BATCH_SIZE
+    ):
+        # openpyxl is only needed for Excel uploads. The read-only workbook
+        # streams rows from the sheet XML instead of building every cell, and
+        # slices are pulled in a thread so parsing never blocks the loop.
+        from openpyxl import load_workbook
+
+        workbook = await asyncio.to_thread(
+            load_workbook, file.file, read_only=True, data_only=True
+        )
+        try:
+            sheet_rows = workbook.active.iter_rows(values_only=True)
+            while True:
+                chunk = await asyncio.to_thread(
+                    lambda: list(islice(sheet_rows, batch_size))
+                )
+                if not chunk:
+                    break
+                for values in chunk:
+                    if all(v is None for v in values):
+                        # Trailing formatted-but-empty rows come through as Nones
+                        yield []
+                    else:
+                        yield [self._xlsx_cell_text(v) for v in values]
+        finally:
+            workbook.close()
+
+    def _xlsx_cell_text(self, value) -> str:
+        # Match what the same sheet saved as CSV would contain
+        if value is None:
+            return ""
+        if isinstance(value, datetime):
+            return value.date().isoformat()
+        if isinstance(value, date):
+            return value.isoformat()
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    async def _iter_stream_rows(self, file: UploadFile):
+        async for record in self._iter_upload_records(file):
+            yield next(csv.reader([record]), [])
+
+    async def _iter_upload_records(
+        self, file: UploadFile, chunk_size: int = GRC_UPLOAD_CHUNK_SIZE
+    ):
+        # Yield one complete CSV record at a time. A record may span several
+        # physical lines when a quoted field contains a newline, so lines are
+        # held back until the quotes seen so far are balanced.
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+        pending = ""
+        parts = []
+        in_quotes = False
+
+        while True:
+            chunk = await file.read(chunk_size)
+            final = not chunk
+            text = pending + decoder.decode(chunk, final=final)
+            *lines, pending = text.split("\n")
+            if final and pending:
+                lines.append(pending)
+                pending = ""
+
+            for line in lines:
+                parts.append(line + "\n")
+                if line.count('"') % 2:
+                    in_quotes = not in_quotes
+                if not in_quotes:
+                    yield "".join(parts)
+                    parts = []
+
+            if final:
+                if parts:
+                    yield "".join(parts)
+                return
+
+    def _grc_row_hash(self, row: dict) -> str:
+        # Hash of the uploaded columns only; receive/return columns never
+        # come from the file and must not make a row look changed
+        payload = "\x1f".join(str(row.get(field)) for field in GRC_HASH_FIELDS)
+        return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+    def _validate_grc_rows(
+        self, rows: List[dict], first_row: int, row_indexes: List[int], errors: list
+    ):
+        # One TypeAdapter pass per batch; every bad row is recorded instead of
+        # stopping at the first one. Line numbers count the header as line 1.
+        try:
+            return GRC_ROWS_ADAPTER.validate_python(rows)
+        except ValidationError as ve:
+            for err in ve.errors(include_url=False):
+                if len(errors) >= GRC_UPLOAD_MAX_ERRORS:
+                    break
+                idx, *field = err["loc"]
+                errors.append(
+                    {
+                        "line": first_row + row_indexes[idx] + 2,
+                        "spare_code": rows[idx].get("spare_code"),
+                        "field": ".".join(str(part) for part in field),
+                        "error": err["msg"],
+                    }
+                )
+            return None
+
+    async def _flush_grc_batch(
+        self,
+        session: AsyncSession,
+        batch: List[dict],
+        first_row: int,
+        present_fields: set,
+        use_copy: bool,
+        counts: dict,
+        errors: list,
+    ):
+        if errors:
+            # Nothing will be written once a bad row has been seen; keep
+            # validating so the response lists every bad row in the file
+            self._validate_grc_rows(batch, first_row, list(range(len(batch))), errors)
+            return
+
+        # The last occurrence of a (spare_code, grc_number) key wins
+        latest = {
+            (row["spare_code"], row["grc_number"]): idx for idx, row in enumerate(batch)
+        }
+        lookup_keys = [
+            key for key in latest if key[0] is not None and isinstance(key[1], int)
+        ]
+
+        existing = {}
+        if lookup_keys:
+            result = await session.execute(
+                select(
+                    GRCCGCEL.spare_code,
+                    GRCCGCEL.grc_number,
+                    GRCCGCEL.row_hash,
+                    GRCCGCEL.status,
+                ).where(
+                    tuple_(GRCCGCEL.spare_code, GRCCGCEL.grc_number).in_(lookup_keys)
+                )
+            )
+            existing = {(r.spare_code, r.grc_number): r for r in result.all()}
+
+        # Rows whose content hash matches an open row are skipped without
+        # validation; everything else is validated and written
+        changed_indexes = []
+        changed_hashes = []
+        for key, idx in latest.items():
+            row_hash = self._grc_row_hash(batch[idx])
+            current = existing.get(key)
+            if current and current.row_hash == row_hash and current.status == "N":
+                counts["unchanged"] += 1
+                continue
+            counts["changed" if current else "new"] += 1
+            changed_indexes.append(idx)
+            changed_hashes.append(row_hash)
+
+        records = self._validate_grc_rows(
+            [batch[idx] for idx in changed_indexes], first_row, changed_indexes, errors
+        )
+        if records is None:
+            return
+        changed = list(zip(records, changed_hashes))
+
+        # Every key in the file, changed or not, keeps its row open
+        await self._copy_rows(session, grc_cgcel_upload_keys, list(latest))
+
+        if not changed:
+            return
+        if use_copy:
+            await self._copy_rows(
+                session,
+                grc_cgcel_stage,
+                [
+                    (
+                        r.spare_code,
+                        r.division,
+                        r.spare_description,
+                        r.grc_number,
+                        r.grc_date,
+                        r.issue_qty,
+                        r.grc_pending_qty,
+                        row_hash,
+                    )
+                    for r, row_hash in changed
+                ],
+            )
+        else:
+            inserted, updated = await self._write_grc_batch(
+                session, changed, present_fields
+            )
+            counts["inserted"] += inserted
+            counts["updated"] += updated
+
+    async def _write_grc_batch(
+        self,
+        session: AsyncSession,
+        records: List[tuple],
+        present_fields: set,
+    ):
+        rows = []
+        for r, row_hash in records:
+            # Only include fields present in the CSV (plus spare_code, grc_number), and set status='N'
+            data_dict = {
+                k: v
+                for k, v in r.dict(exclude_unset=False).items()
+                if k in GRC_KEY_FIELDS or k in present_fields
+            }
+            data_dict["status"] = "N"
+            data_dict["row_hash"] = row_hash
+            rows.append(data_dict)
+
+        table = GRCCGCEL.__table__
+
+        # Only update fields present in the CSV (excluding spare_code, grc_number).
+        # xmax is 0 only for freshly inserted tuples, which splits the counts.
+        stmt = pg_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.spare_code, table.c.grc_number],
+            set_={
+                field: stmt.excluded[field]
+                for field in present_fields | {"status", "row_hash"}
+            },
+        ).returning(literal_column("(xmax = 0)", Boolean).label("inserted"))
+
+        result = await session.execute(stmt, rows)
+        flags = result.scalars().all()
+        inserted = sum(1 for flag in flags if flag)
+        return inserted, len(flags) - inserted
+
+    async def _create_temp_table(self, session: AsyncSession, table):
+        connection = await session.connection()
+        await connection.run_sync(table.create)
+
+    async def _copy_rows(self, session: AsyncSession, table, records: List[tuple]):
+        # COPY goes straight through the asyncpg connection that backs the
+        # session, so it runs inside the same transaction as the merge
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            table.name,
+            records=records,
+            columns=[c.name for c in table.columns],
+        )
+
+    async def _merge_grc_stage(self, session: AsyncSession, present_fields: set):
+        table = GRCCGCEL.__table__
+        stage = grc_cgcel_stage
+        columns = [*GRC_KEY_FIELDS, *sorted(present_fields), "row_hash"]
+
+        # A key repeated across batches is staged more than once; keep the
+        # copy staged last (ctid follows insertion order in a fresh table)
+        latest = (
+            select(*[stage.c[c] for c in columns], literal("N").label("status"))
+            .distinct(stage.c.spare_code, stage.c.grc_number)
+            .order_by(
+                stage.c.spare_code,
+                stage.c.grc_number,
+                literal_column("ctid").desc(),
+            )
+        )
+        stmt = pg_insert(table).from_select([*columns, "status"], latest)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.spare_code, table.c.grc_number],
+            set_={
+                field: stmt.excluded[field]
+                for field in present_fields | {"status", "row_hash"}
+            },
+        )
+        merged = stmt.returning(
+            literal_column("(xmax = 0)", Boolean).label("inserted")
+        ).cte("merged")
+
+        result = await session.execute(
+            select(
+                func.count().filter(merged.c.inserted),
+                func.count().filter(~merged.c.inserted),
+            )
+        )
+        inserted, updated = result.one()
+        return inserted, updated
+
+    async def _reconcile_grc_status(self, session: AsyncSession):
+        # Close only the open rows that are missing from the uploaded file.
+        # Rows present in the file are already 'N' (written by the upsert or
+        # skipped as unchanged), so the anti-join touches just the delta
+        # instead of the whole table. status = 'N' matches the predicate of
+        # ix_grc_cgcel_open_division, so only open rows are visited.
+        table = GRCCGCEL.__table__
+        keys = grc_cgcel_upload_keys
+        uploaded = (
+            select(literal(1))
+            .where(
+                keys.c.spare_code == table.c.spare_code,
+                keys.c.grc_number == table.c.grc_number,
+            )
+            .exists()
+        )
+        await session.execute(
+            update(table)
+            .where(table.c.status == "N", ~uploaded)
+            .values(status="Y")
+        )
+
+    async def not_received_grc_numbers(
+        self, session: AsyncSession, tag: Optional[str] = None
+    ):
+        # tag is the change_tag() the caller read for the receive scope;
+        # without one the cache cannot be validated and is skipped
+        if tag is not None:
+            rows = self.read_cache.get(GRC_SCOPE_RECEIVE, tag)
+            if rows is not None:
+                return rows
         statement = (
             select(GRCCGCEL.grc_number)
             .where(
@@ -207,103 +779,176 @@ class GRCCGCELService:
         )
         result = await session.execute(statement)
         rows = result.scalars().all()
+        if tag is not None:
+            self.read_cache.set(GRC_SCOPE_RECEIVE, tag, rows)
         return rows
 
     async def not_received_by_grc_number(self, grc_number: int, session: AsyncSession):
-        statement = select(GRCCGCEL).where(
+        # Only the schema columns, returned as plain dicts in schema shape
+        statement = select(
+            *[getattr(GRCCGCEL, field) for field in GRC_RECEIVE_VIEW_FIELDS]
+        ).where(
             GRCCGCEL.grc_number == grc_number,
             GRCCGCEL.receive_date.is_(None),
         )
         result = await session.execute(statement)
-        rows = result.scalars().all()
-        return [
-            GRCCGCELReceiveSchema(
-                spare_code=row.spare_code,
-                division=row.division,
-                spare_description=row.spare_description,
-                issue_qty=row.issue_qty,
-                receive_qty=row.receive_qty,
-                damaged_qty=row.damaged_qty,
-                short_qty=row.short_qty,
-                alt_spare_qty=row.alt_spare_qty,
-                alt_spare_code=row.alt_spare_code,
-                dispute_remark=row.dispute_remark,
-            )
-            for row in rows
-        ]
+        return [dict(row) for row in result.mappings()]
 
     async def update_cgcel_grc_receive(
         self, updateData: List[GRCCGCELUpdateReceiveSchema], session: AsyncSession
     ):
-        for data in updateData:
-            existing_record = await self.get_grc_cgcel_by_code(
-                data.spare_code, data.grc_number, session
-            )
-            for key, value in data.model_dump().items():
-                if key not in ("spare_code", "grc_number") and value is not None:
-                    setattr(existing_record, key, value)
-            existing_record.receive_date = date.today()
-            session.add(existing_record)
+        # Set-based: one fetch, one UPDATE ... FROM (VALUES ...) and one
+        # dispute upsert, however many lines the receive screen sends. The
+        # last line wins when the same key is sent twice.
+        rows = {(data.spare_code, data.grc_number): data for data in updateData}
+        if not rows:
+            return {"updated": 0, "missing": [], "rows": []}
+
+        result = await session.execute(
+            select(
+                GRCCGCEL.spare_code,
+                GRCCGCEL.grc_number,
+                GRCCGCEL.division,
+                GRCCGCEL.grc_date,
+                GRCCGCEL.spare_description,
+                GRCCGCEL.issue_qty,
+                GRCCGCEL.grc_pending_qty,
+            ).where(tuple_(GRCCGCEL.spare_code, GRCCGCEL.grc_number).in_(list(rows)))
+        )
+        existing = {(r.spare_code, r.grc_number): r for r in result.all()}
+
+        missing = [
+            {"spare_code": key[0], "grc_number": key[1]}
+            for key in rows
+            if key not in existing
+        ]
+        found = [data for key, data in rows.items() if key in existing]
+        if not found:
+            return {"updated": 0, "missing": missing, "rows": []}
 
-            # If issue_qty != receive_qty, add to GRCCGCELDispute
-            if getattr(data, "issue_qty", None) != getattr(data, "receive_qty", None):
+        table = GRCCGCEL.__table__
+        lines = self._versioned_lines(
+            [column(field, table.c[field].type) for field in GRC_RECEIVE_FIELDS],
+            [
+                (
+                    data.spare_code,
+                    data.grc_number,
+                    *(getattr(data, field) for field in GRC_RECEIVE_FIELDS),
+                    data.version,
+                )
+                for data in found
+            ],
+        )
 
-                dispute_data = GRCCGCELDisputeCreate(
+        # Only values sent as non-null overwrite what is stored
+        stmt = (
+            self._versioned_update(lines)
+            .values(
+                receive_date=date.today(),
+                version=table.c.version + 1,
+                **{
+                    field: func.coalesce(
+                        cast(lines.c[field], table.c[field].type), table.c[field]
+                    )
+                    for field in GRC_RECEIVE_FIELDS
+                },
+            )
+            .returning(
+                table.c.spare_code,
+                table.c.grc_number,
+                table.c.division,
+                table.c.version,
+            )
+        )
+
+        # A line is disputed when the received quantity differs from the issue
+        disputes = []
+        for data in found:
+            record = existing[(data.spare_code, data.grc_number)]
+            if data.receive_qty is None or data.receive_qty == record.issue_qty:
+                continue
+            disputes.append(
+                GRCCGCELDisputeCreate(
                     spare_code=data.spare_code,
-                    division=getattr(
-                        data, "division", getattr(existing_record, "division", None)
-                    ),
+                    division=record.division,
                     grc_number=data.grc_number,
-                    grc_date=getattr(existing_record, "grc_date", None),
-                    spare_description=getattr(
-                        data,
-                        "spare_description",
-                        getattr(existing_record, "spare_description", None),
-                    ),
-                    issue_qty=getattr(existing_record, "issue_qty", None),
-                    grc_pending_qty=getattr(
-                        data,
-                        "grc_pending_qty",
-                        getattr(existing_record, "grc_pending_qty", None),
-                    ),
-                    damaged_qty=getattr(data, "damaged_qty", None),
-                    short_qty=getattr(data, "short_qty", None),
-                    alt_spare_qty=getattr(data, "alt_spare_qty", None),
-                    alt_spare_code=getattr(data, "alt_spare_code", None),
-                    dispute_remark=getattr(data, "dispute_remark", None),
-                )
-                dispute_record = GRCCGCELDispute(**dispute_data.model_dump())
-                session.add(dispute_record)
+                    grc_date=record.grc_date,
+                    spare_description=record.spare_description,
+                    issue_qty=record.issue_qty,
+                    grc_pending_qty=record.grc_pending_qty,
+                    damaged_qty=data.damaged_qty,
+                    short_qty=data.short_qty,
+                    alt_spare_qty=data.alt_spare_qty,
+                    alt_spare_code=data.alt_spare_code,
+                    dispute_remark=data.dispute_remark,
+                ).model_dump()
+            )
+
         try:
+            result = await session.execute(stmt)
+            received = result.all()
+            await self._check_unmatched(
+                session,
+                {(data.spare_code, data.grc_number): data.version for data in found},
+                {(r.spare_code, r.grc_number) for r in received},
+            )
+            if disputes:
+                # Receiving the same line again refreshes its dispute
+                dispute_table = GRCCGCELDispute.__table__
+                dispute_stmt = pg_insert(dispute_table).values(disputes)
+                dispute_stmt = dispute_stmt.on_conflict_do_update(
+                    index_elements=[
+                        dispute_table.c.spare_code,
+                        dispute_table.c.grc_number,
+                    ],
+                    set_={
+                        field: dispute_stmt.excluded[field]
+                        for field in disputes[0]
+                        if field not in GRC_KEY_FIELDS
+                    },
+                )
+                await session.execute(dispute_stmt)
+            # The return sheets show version too, so they change with it
+            scopes = [GRC_SCOPE_RECEIVE] + [
+                self.return_scope(r.division) for r in received
+            ]
+            await self._bump_change_counters(session, scopes)
             await session.commit()
-        except:
+            self.read_cache.invalidate(scopes)
+        except Exception:
             await session.rollback()
+            raise
 
-    async def grc_return_by_division(self, division: str, session: AsyncSession):
-        statement = select(GRCCGCEL).where(
+        return {
+            "updated": len(received),
+            "missing": missing,
+            "rows": self._row_versions(received),
+        }
+
+    async def grc_return_by_division(
+        self, division: str, session: AsyncSession, tag: Optional[str] = None
+    ):
+        # tag is the change_tag() over the upload and return scopes
+        scope = self.return_scope(division)
+        if tag is not None:
+            rows = self.read_cache.get(scope, tag)
+            if rows is not None:
+                return rows
+        statement = select(
+            *[getattr(GRCCGCEL, field) for field in GRC_RETURN_VIEW_FIELDS]
+        ).where(
             GRCCGCEL.division == division,
             GRCCGCEL.status == "N",
         ).order_by(GRCCGCEL.grc_number)
         result = await session.execute(statement)
-        rows = result.all()
-        return [
-            GRCCGCELReturnSchema(
-                grc_number=row.GRCCGCEL.grc_number,
-                grc_date=format_date_ddmmyyyy(row.GRCCGCEL.grc_date),
-                spare_code=row.GRCCGCEL.spare_code,
-                spare_description=row.GRCCGCEL.spare_description,
-                issue_qty=row.GRCCGCEL.issue_qty,
-                grc_pending_qty=row.GRCCGCEL.grc_pending_qty,
-                actual_pending_qty=row.GRCCGCEL.actual_pending_qty,
-                returned_qty=row.GRCCGCEL.returned_qty,
-                good_qty=row.GRCCGCEL.good_qty,
-                defective_qty=row.GRCCGCEL.defective_qty,
-                invoice=row.GRCCGCEL.invoice,
-                docket_number=row.GRCCGCEL.docket_number,
-                sent_through=row.GRCCGCEL.sent_through,
-            )
-            for row in rows
-        ]
+        rows = []
+        for row in result.mappings():
+            record = dict(row)
+            record["grc_date"] = format_date_ddmmyyyy(record["grc_date"])
+            rows.append(record)
+        if tag is not None:
+            self.read_cache.set(scope, tag, rows)
+        return rows
 
     #
 
@@ -325,113 +970,352 @@ class GRCCGCELService:
         updateData: List[GRCCGCELReturnSave],
         session: AsyncSession,
     ):
-        keys = [(d.spare_code, d.grc_number) for d in updateData]
-        result = await session.execute(
-            select(GRCCGCEL).where(
-                tuple_(GRCCGCEL.spare_code, GRCCGCEL.grc_number).in_(keys)
-            )
-        )
-        existing_records = {(r.spare_code, r.grc_number): r for r in result.scalars().all()}
-        for data in updateData:
-            key = (data.spare_code, data.grc_number)
-            existing_record = existing_records.get(key)
-            if not existing_record:
-                continue  # or raise error if required
-            for k, v in data.model_dump().items():
-                if k not in ("spare_code", "grc_number") and v is not None:
-                    setattr(existing_record, k, v)
-            # No need to session.add(existing_record) if already loaded
+        rows = {(data.spare_code, data.grc_number): data for data in updateData}
+        if not rows:
+            return {"updated": 0, "missing": [], "rows": []}
+
+        table = GRCCGCEL.__table__
+        lines = self._versioned_lines(
+            [column(field, table.c[field].type) for field in GRC_RETURN_SAVE_FIELDS],
+            [
+                (
+                    data.spare_code,
+                    data.grc_number,
+                    *(getattr(data, field) for field in GRC_RETURN_SAVE_FIELDS),
+                    data.version,
+                )
+                for data in rows.values()
+            ],
+        )
+
+        # Only values sent as non-null overwrite what is stored
+        stmt = (
+            self._versioned_update(lines)
+            .values(
+                version=table.c.version + 1,
+                **{
+                    field: func.coalesce(
+                        cast(lines.c[field], table.c[field].type), table.c[field]
+                    )
+                    for field in GRC_RETURN_SAVE_FIELDS
+                },
+            )
+            .returning(
+                table.c.spare_code,
+                table.c.grc_number,
+                table.c.division,
+                table.c.version,
+            )
+        )
+
         try:
+            result = await session.execute(stmt)
+            saved = result.all()
+            updated = {(r.spare_code, r.grc_number) for r in saved}
+            missing = await self._check_unmatched(
+                session, {key: data.version for key, data in rows.items()}, updated
+            )
+            scopes = [GRC_SCOPE_RECEIVE] + [
+                self.return_scope(r.division) for r in saved
+            ]
+            await self._bump_change_counters(session, scopes)
             await session.commit()
+            self.read_cache.invalidate(scopes)
         except Exception:
             await session.rollback()
+            raise
+
+        return {
+            "updated": len(updated),
+            "missing": missing,
+            "rows": self._row_versions(saved),
+        }
+
+    def _row_versions(self, rows) -> List[dict]:
+        # New version of each written row, so a client can write it again
+        # without reloading (its old version would now conflict)
+        return [
+            {
+                "spare_code": row.spare_code,
+                "grc_number": row.grc_number,
+                "version": row.version,
+            }
+            for row in rows
+        ]
+
+    def _versioned_lines(self, columns: list, data: List[tuple]):
+        # VALUES list of (spare_code, grc_number, *columns, expected_version).
+        # expected_version is the version the client read; NULL skips the check.
+        # A column that is NULL on every line is typed text by PostgreSQL, so
+        # callers cast nullable columns where they use them.
+        return values(
+            column("spare_code", String),
+            column("grc_number", Integer),
+            *columns,
+            column("expected_version", Integer),
+            name="lines",
+        ).data(data)
+
+    def _versioned_update(self, lines):
+        # Rows edited by someone else since the client read them do not match
+        table = GRCCGCEL.__table__
+        return update(table).where(
+            table.c.spare_code == lines.c.spare_code,
+            table.c.grc_number == lines.c.grc_number,
+            or_(
+                lines.c.expected_version.is_(None),
+                table.c.version == cast(lines.c.expected_version, Integer),
+            ),
+        )
+
+    async def _check_unmatched(
+        self, session: AsyncSession, expected: dict, updated: set
+    ) -> List[dict]:
+        # Keys a versioned UPDATE skipped are either gone (returned as
+        # missing) or were changed concurrently (raised as a conflict)
+        unmatched = [key for key in expected if key not in updated]
+        if not unmatched:
+            return []
+
+        result = await session.execute(
+            select(GRCCGCEL.spare_code, GRCCGCEL.grc_number, GRCCGCEL.version).where(
+                tuple_(GRCCGCEL.spare_code, GRCCGCEL.grc_number).in_(unmatched)
+            )
+        )
+        current = {(r.spare_code, r.grc_number): r.version for r in result.all()}
+
+        conflicts = [
+            {
+                "spare_code": key[0],
+                "grc_number": key[1],
+                "expected_version": expected[key],
+                "current_version": current[key],
+            }
+            for key in unmatched
+            if key in current
+        ]
+        if conflicts:
+            raise GRCVersionConflict(conflicts)
+
+        return [{"spare_code": key[0], "grc_number": key[1]} for key in unmatched]
 
     async def finalize_cgcel_grc_return(
         self, updateData: GRCCGCELReturnFinalizePayload, session: AsyncSession, token: dict
     ):
         # updateData: GRCCGCELReturnFinalizePayload
-        #   - challan_number: str
+        #   - challan_number: ignored, allocated here (see allocate_challan_number)
         #   - division: str
         #   - sent_through: Optional[str]
         #   - docket_number: Optional[str]
         #   - grc_rows: List[GRCCGCELFinalizeRow]
-        keys = [(row.spare_code, row.grc_number) for row in updateData.grc_rows]
-        result = await session.execute(
-            select(GRCCGCEL).where(
-                tuple_(GRCCGCEL.spare_code, GRCCGCEL.grc_number).in_(keys)
+        #
+        # Set-based: the quantity arithmetic runs in one UPDATE ... FROM
+        # (VALUES ...) and history rows go in with one INSERT ... RETURNING,
+        # so the statement count does not grow with the challan size.
+        rows = {(row.spare_code, row.grc_number): row for row in updateData.grc_rows}
+        if not rows:
+            return {"challan_number": None, "rows": [], "missing": []}
+
+        username = token["user"]["username"]
+        today = date.today()
+        table = GRCCGCEL.__table__
+
+        # Allocated inside this transaction so concurrent finalizes never
+        # share a number, whatever the client previewed
+        challan_number = await self.allocate_challan_number(session)
+
+        lines = self._versioned_lines(
+            [column("good_qty", Integer), column("defective_qty", Integer)],
+            [
+                (
+                    row.spare_code,
+                    row.grc_number,
+                    row.good_qty or 0,
+                    row.defective_qty or 0,
+                    row.version,
+                )
+                for row in rows.values()
+            ],
+        )
+        returning_qty = lines.c.good_qty + lines.c.defective_qty
+
+        stmt = (
+            self._versioned_update(lines)
+            .values(
+                version=table.c.version + 1,
+                returning_qty=returning_qty,
+                returned_qty=func.coalesce(table.c.returned_qty, 0) + returning_qty,
+                actual_pending_qty=func.coalesce(table.c.actual_pending_qty, 0)
+                - returning_qty,
+                good_qty=0,
+                defective_qty=0,
+                challan_number=challan_number,
+                challan_date=today,
+                sent_through=updateData.sent_through,
+                docket_number=updateData.docket_number,
+                challan_by=username,
+            )
+            .returning(
+                table.c.spare_code,
+                table.c.grc_number,
+                table.c.division,
+                table.c.version,
+                table.c.spare_description,
+                table.c.grc_date,
+                table.c.issue_qty,
+                table.c.grc_pending_qty,
+                table.c.dispute_remark,
+                table.c.returned_qty,
+                table.c.actual_pending_qty,
+                lines.c.good_qty,
+                lines.c.defective_qty,
+                table.c.returning_qty,
             )
         )
-        existing_records = {(r.spare_code, r.grc_number): r for r in result.scalars().all()}
-        history_records = []
-        updated_records = []
-        for row in updateData.grc_rows:
-            key = (row.spare_code, row.grc_number)
-            existing_record = existing_records.get(key)
-            if not existing_record:
-                continue
-            good_qty = getattr(row, "good_qty", 0) or 0
-            defective_qty = getattr(row, "defective_qty", 0) or 0
-            returning_qty = good_qty + defective_qty
-            # Always add to history if returning_qty > 0
-            if returning_qty > 0:
-                history_kwargs = {
+
+        try:
+            result = await session.execute(stmt)
+            updated = result.all()
+            missing = await self._check_unmatched(
+                session,
+                {key: row.version for key, row in rows.items()},
+                {(row.spare_code, row.grc_number) for row in updated},
+            )
+
+            # Only lines that actually send something back go to history
+            history_rows = [
+                {
                     "division": updateData.division,
                     "spare_code": row.spare_code,
-                    "spare_description": getattr(existing_record, "spare_description", None),
+                    "spare_description": row.spare_description,
                     "grc_number": row.grc_number,
-                    "grc_date": getattr(existing_record, "grc_date", None),
-                    "issue_qty": getattr(existing_record, "issue_qty", None),
-                    "grc_pending_qty": getattr(existing_record, "grc_pending_qty", None),
-                    "good_qty": good_qty,
-                    "defective_qty": defective_qty,
-                    "returning_qty": returning_qty,
-                    "challan_number": updateData.challan_number,
-                    "challan_date": date.today(),
+                    "grc_date": row.grc_date,
+                    "issue_qty": row.issue_qty,
+                    "grc_pending_qty": row.grc_pending_qty,
+                    "good_qty": row.good_qty,
+                    "defective_qty": row.defective_qty,
+                    "returning_qty": row.returning_qty,
+                    "challan_number": challan_number,
+                    "challan_date": today,
                     "docket_number": updateData.docket_number,
                     "sent_through": updateData.sent_through,
-                    "dispute_remark": getattr(existing_record, "dispute_remark", None),
-                    "challan_by": token["user"]["username"],
+                    "dispute_remark": row.dispute_remark,
+                    "challan_by": username,
                 }
-                history_records.append(GRCCGCELReturnHistory(**history_kwargs))
-            # Update the main record
-            existing_record.challan_by = token["user"]["username"]
-            new_good_qty = getattr(row, "good_qty", 0) or 0
-            new_defective_qty = getattr(row, "defective_qty", 0) or 0
-            existing_record.returning_qty = new_good_qty + new_defective_qty
-            prev_returned_qty = getattr(existing_record, "returned_qty", 0) or 0
-            existing_record.returned_qty = prev_returned_qty + new_good_qty + new_defective_qty
-            prev_actual_pending_qty = getattr(existing_record, "actual_pending_qty", 0) or 0
-            existing_record.actual_pending_qty = prev_actual_pending_qty - (new_good_qty + new_defective_qty)
-            existing_record.challan_date = date.today()
-            existing_record.good_qty = 0
-            existing_record.defective_qty = 0
-            existing_record.challan_number = updateData.challan_number
-            existing_record.sent_through = updateData.sent_through
-            existing_record.docket_number = updateData.docket_number
-            existing_record.challan_date = date.today()
-            existing_record.challan_by = token["user"]["username"]
-            updated_records.append(existing_record)
-        for rec in updated_records:
-            session.add(rec)
-        if history_records:
-            session.add_all(history_records)
-        try:
+                for row in updated
+                if row.returning_qty > 0
+            ]
+            history_ids = {}
+            if history_rows:
+                history = GRCCGCELReturnHistory.__table__
+                result = await session.execute(
+                    insert(history)
+                    .values(history_rows)
+                    .returning(history.c.id, history.c.spare_code, history.c.grc_number)
+                )
+                history_ids = {(r.spare_code, r.grc_number): r.id for r in result.all()}
+
+            scopes = [GRC_SCOPE_RECEIVE] + [
+                self.return_scope(row.division) for row in updated
+            ]
+            await self._bump_change_counters(session, scopes)
             await session.commit()
-        except Exception as e:
-            print("Commit error:", e)
+            self.read_cache.invalidate(scopes)
+        except Exception:
+            await session.rollback()
+            raise
+
+        if history_rows:
+            # The challan is final now; render its reports ahead of the print
+            self._schedule_prewarm([challan_number])
+
+        finalized = [
+            {
+                "spare_code": row.spare_code,
+                "grc_number": row.grc_number,
+                "returning_qty": row.returning_qty,
+                "returned_qty": row.returned_qty,
+                "actual_pending_qty": row.actual_pending_qty,
+                "version": row.version,
+                "history_id": history_ids.get((row.spare_code, row.grc_number)),
+            }
+            for row in updated
+        ]
+        return {
+            "challan_number": challan_number,
+            "rows": finalized,
+            "missing": missing,
+        }
+
+    def return_scope(self, division: str) -> str:
+        return f"return:{division}"
+
+    async def _bump_change_counters(self, session: AsyncSession, scopes: List[str]):
+        # Runs last in the writing transaction, so the counter rows stay
+        # locked only until commit. Sorted to keep lock order stable.
+        # A write that bumps a row's version must bump every scope whose
+        # view exposes that row, or a client keeps a stale version.
+        scopes = sorted(set(scopes))
+        if not scopes:
+            return
+        table = GRCCGCELChangeCounter.__table__
+        stmt = pg_insert(table).values([{"scope": scope, "version": 1} for scope in scopes])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.scope], set_={"version": table.c.version + 1}
+        )
+        await session.execute(stmt)
+        # Delivered to every worker's read cache only if this commits
+        await session.execute(
+            select(func.pg_notify(GRC_CACHE_CHANNEL, ",".join(scopes)))
+        )
+
+    async def change_tag(self, session: AsyncSession, scopes: List[str]) -> str:
+        # Entity tag for a read over the given scopes; reads only the
+        # counter rows, never the GRC rows themselves
+        result = await session.execute(
+            select(GRCCGCELChangeCounter.scope, GRCCGCELChangeCounter.version).where(
+                GRCCGCELChangeCounter.scope.in_(scopes)
+            )
+        )
+        versions = dict(result.all())
+        return '"' + "-".join(str(versions.get(scope, 0)) for scope in scopes) + '"'
 
     async def next_cgcel_challan_code(self, session: AsyncSession):
-        statement = (
-            select(GRCCGCELReturnHistory.challan_number)
-            .order_by(GRCCGCELReturnHistory.challan_number.desc())
-            .limit(1)
+        # Preview only: nothing is consumed, and the number actually used is
+        # the one finalize_cgcel_grc_return returns. With reserve-ahead this
+        # worker hands out its reserved block first, so the preview is the
+        # head of that block; another worker may still finalize from its
+        # own block, and clients must print the number finalize returns.
+        if self.challan_block_size > 1 and self._reserved_challans:
+            return self._format_challan_number(self._reserved_challans[0])
+        result = await session.execute(
+            select(
+                literal_column("last_value"), literal_column("is_called")
+            ).select_from(text(grc_cgcel_challan_seq.name))
         )
-        result = await session.execute(statement)
-        last_code = result.scalar()
-        last_number = str(last_code)[1:] if last_code else "0"
-        next_number = int(last_number) + 1
-        next_challan_number = "G" + str(next_number).zfill(5)
-        return next_challan_number
+        last_value, is_called = result.one()
+        next_number = last_value + 1 if is_called else last_value
+        return self._format_challan_number(next_number)
+
+    async def allocate_challan_number(self, session: AsyncSession) -> str:
+        if self.challan_block_size <= 1:
+            result = await session.execute(select(grc_cgcel_challan_seq.next_value()))
+            return self._format_challan_number(result.scalar())
+
+        # Reserve-ahead: take a block of numbers in one round trip and hand
+        # them out locally. Numbers left when the worker stops become gaps.
+        async with self._challan_lock:
+            if not self._reserved_challans:
+                result = await session.execute(
+                    select(grc_cgcel_challan_seq.next_value()).select_from(
+                        func.generate_series(1, self.challan_block_size)
+                    )
+                )
+                self._reserved_challans.extend(result.scalars().all())
+            return self._format_challan_number(self._reserved_challans.popleft())
+
+    def _format_challan_number(self, number: int) -> str:
+        return "G" + str(number).zfill(5)
 
     async def generate_grc_report(
         self, report_type: str, data, session: AsyncSession, token
@@ -444,107 +1328,267 @@ class GRCCGCELService:
         else:
             data_dict = data
 
-        def generate_overlay(data):
-            packet = io.BytesIO()
-            can = canvas.Canvas(packet, pagesize=A4)
-            width, height = A4
-
-            def draw_centered(can, text, x_start, x_end, y, font="Helvetica", size=9):
-                text = "" if text is None else str(text)
-                can.setFont(font, size)
-                text_width = can.stringWidth(text, font, size)
-                x_mid = x_start + (x_end - x_start) / 2
-                can.drawString(x_mid - text_width / 2, y, text)
-
-            def draw_block(start_y_offset):
-                # Header
-                can.setFont("Helvetica-Bold", 10)
-                can.drawString(
-                    88, 740 - start_y_offset, f"{data.get('challan_number', '')}"
-                )
-                can.drawString(
-                    250, 740 - start_y_offset, date.today().strftime("%d-%m-%Y")
-                )
-                can.drawString(476, 740 - start_y_offset, f"{data.get('division', '')}")
-                can.drawString(
-                    476, 704 - start_y_offset, f"{data.get('docket_number', '')}"
+        # Drawing and merging run in the renderer's worker processes; the
+        # PDF comes back as a file streamed out in chunks
+        report_path = await self.report_renderer.render(
+            report_type, data_dict, token["user"]["username"]
+        )
+        return stream_report(report_path)
+
+    def normalise_challan_number(self, challan_number: str) -> str:
+        if len(challan_number) != 6:
+            challan_number = "G" + str(challan_number).zfill(5)
+        return challan_number
+
+    async def challan_report(
+        self, session: AsyncSession, challan_number: str, report_type: str
+    ) -> Optional[str]:
+        # Path of the stored report PDF, rendered from return history on a
+        # miss; None when the challan does not exist
+        template_hash = grc_templates.template_hash(report_type)
+        path = self.report_store.get(challan_number, report_type, template_hash)
+        if path:
+            return path
+        challans = await self.challan_report_data(session, [challan_number])
+        if challan_number not in challans:
+            return None
+        return await self._store_challan_report(
+            challans[challan_number], report_type, template_hash
+        )
+
+    async def prewarm_challan_reports(
+        self, challan_numbers: List[str], report_types: Optional[List[str]] = None
+    ) -> dict:
+        # Renders every missing (challan, report type) into the report store
+        report_types = report_types or list(GRC_REPORT_COLUMNS)
+        async for session in get_session():
+            challans = await self.challan_report_data(session, challan_numbers)
+
+        renders = []
+        cached = 0
+        for report_type in report_types:
+            template_hash = grc_templates.template_hash(report_type)
+            for challan_number, challan in challans.items():
+                if self.report_store.get(challan_number, report_type, template_hash):
+                    cached += 1
+                    continue
+                renders.append(
+                    self._store_challan_report(challan, report_type, template_hash)
                 )
-                can.drawString(
-                    144, 704 - start_y_offset, f"{data.get('sent_through', '')}"
+        await asyncio.gather(*renders)
+        return {
+            "rendered": len(renders),
+            "cached": cached,
+            "missing": [number for number in challan_numbers if number not in challans],
+        }
+
+    async def _store_challan_report(
+        self, challan: dict, report_type: str, template_hash: str
+    ) -> str:
+        rendered = await self.report_renderer.render(
+            report_type,
+            self.challan_report_payload(challan, report_type),
+            challan["challan_by"] or "",
+        )
+        return await asyncio.to_thread(
+            self.report_store.put,
+            challan["challan_number"],
+            report_type,
+            template_hash,
+            rendered,
+        )
+
+    def prewarm_challan_numbers(self, challan_numbers: List[str]) -> List[str]:
+        # Validated, de-duplicated challan numbers for an admin prewarm
+        unique = list(
+            dict.fromkeys(
+                self.normalise_challan_number(number) for number in challan_numbers
+            )
+        )
+        if not unique:
+            raise ValueError("No challan numbers given")
+        if len(unique) > GRC_REPORT_PREWARM_MAX_CHALLANS:
+            raise ValueError(
+                f"At most {GRC_REPORT_PREWARM_MAX_CHALLANS} challans per prewarm"
+            )
+        return unique
+
+    async def _challan_report_part(self, challan: dict, report_type: str) -> str:
+        # Spooled copy of the stored report, rendered into the store on a
+        # miss. The copy belongs to the caller, as a fresh render would.
+        template_hash = grc_templates.template_hash(report_type)
+        path = self.report_store.get(
+            challan["challan_number"], report_type, template_hash
+        )
+        if path is None:
+            path = await self._store_challan_report(
+                challan, report_type, template_hash
+            )
+        return await asyncio.to_thread(copy_report, path)
+
+    def _schedule_prewarm(self, challan_numbers: List[str]):
+        task = asyncio.create_task(self.prewarm_challan_reports(challan_numbers))
+        # Keep a reference until done; a failed prewarm only costs a render
+        # at print time
+        self._prewarm_tasks.add(task)
+        task.add_done_callback(self._prewarm_done)
+
+    def _prewarm_done(self, task: asyncio.Task):
+        self._prewarm_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+
+    def batch_print_jobs(
+        self, jobs: List[GRCBatchPrintJob], output: str
+    ) -> List[GRCBatchPrintJob]:
+        # Validated, de-duplicated jobs with normalised challan numbers
+        if output not in GRC_BATCH_PRINT_OUTPUTS:
+            raise ValueError(f"Invalid output '{output}', expected zip or pdf")
+        unique = {}
+        for job in jobs:
+            if job.report_type not in GRC_REPORT_COLUMNS:
+                raise ValueError(
+                    f"Invalid report type '{job.report_type}', expected Good, Defective or All"
                 )
-                can.drawString(474, 36 - start_y_offset, f"{token['user']['username']}")
-
-                can.setFont("Helvetica", 11)
-                y = 660 - start_y_offset
-                items = data.get("grc_rows", [])
-                for idx, item in enumerate(items, 1):
-                    if report_type == "Defective":
-                        draw_centered(can, item.get("grc_number"), 15, 80, y)
-                        draw_centered(can, item.get("grc_date"), 80, 135, y)
-                        draw_centered(can, item.get("spare_code"), 135, 240, y)
-                        draw_centered(can, item.get("spare_description"), 240, 545, y)
-                        draw_centered(can, item.get("defective_qty") or 0, 545, 580, y)
-                    elif report_type == "Good":
-                        draw_centered(can, item.get("grc_number"), 15, 80, y)
-                        draw_centered(can, item.get("grc_date"), 80, 135, y)
-                        draw_centered(can, item.get("spare_code"), 135, 240, y)
-                        draw_centered(can, item.get("spare_description"), 240, 545, y)
-                        draw_centered(can, item.get("good_qty") or 0, 545, 580, y)
-                    else:
-                        draw_centered(can, item.get("grc_number"), 15, 80, y)
-                        draw_centered(can, item.get("grc_date"), 80, 135, y)
-                        draw_centered(can, item.get("spare_code"), 135, 240, y)
-                        draw_centered(can, item.get("spare_description"), 240, 467, y)
-                        draw_centered(
-                            can, item.get("actual_pending_qty") or 0, 467, 510, y
-                        )
-                        draw_centered(can, item.get("good_qty") or 0, 510, 545, y)
-                        draw_centered(can, item.get("defective_qty") or 0, 545, 580, y)
-                    y -= 19
-                    if y < 100:
-                        break  # Avoid overflow for now
-
-            # Draw only one block (single copy)
-            draw_block(start_y_offset=0)
-
-            can.save()
-            packet.seek(0)
-            return PdfReader(packet)
-
-        overlay = generate_overlay(data_dict)
-
-        # Path to the static PDF template (use absolute path for portability, with path injection protection)
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        static_dir = os.path.normpath(os.path.join(base_dir, "..", "static"))
-        if report_type == "Defective":
-            template_path = safe_join(static_dir, "grc_cgcel_defective.pdf")
-        elif report_type == "Good":
-            template_path = safe_join(static_dir, "grc_cgcel_good.pdf")
-        else:
-            template_path = safe_join(static_dir, "grc_cgcel_all.pdf")
+            challan_number = self.normalise_challan_number(job.challan_number)
+            unique[(challan_number, job.report_type)] = GRCBatchPrintJob(
+                challan_number=challan_number, report_type=job.report_type
+            )
+        if not unique:
+            raise ValueError("No print jobs given")
+        if len(unique) > GRC_BATCH_PRINT_MAX_JOBS:
+            raise ValueError(f"At most {GRC_BATCH_PRINT_MAX_JOBS} print jobs per batch")
+        return list(unique.values())
+
+    async def challan_report_data(
+        self, session: AsyncSession, challan_numbers: List[str]
+    ) -> dict:
+        # Report payloads rebuilt from return history, keyed by challan
+        # number. History does not keep the pending qty printed on the
+        # challan, so it is recovered as today's actual_pending_qty plus
+        # every return from this challan onwards for the same GRC line.
+        history = GRCCGCELReturnHistory
+        returned_keys = select(history.spare_code, history.grc_number).where(
+            history.challan_number.in_(challan_numbers)
+        )
+        pending = (
+            select(
+                history.id,
+                (
+                    func.coalesce(GRCCGCEL.actual_pending_qty, 0)
+                    + func.sum(history.returning_qty).over(
+                        partition_by=(history.spare_code, history.grc_number),
+                        order_by=history.id.desc(),
+                    )
+                ).label("actual_pending_qty"),
+            )
+            .outerjoin(
+                GRCCGCEL,
+                and_(
+                    GRCCGCEL.spare_code == history.spare_code,
+                    GRCCGCEL.grc_number == history.grc_number,
+                ),
+            )
+            .where(tuple_(history.spare_code, history.grc_number).in_(returned_keys))
+            .subquery()
+        )
+        result = await session.execute(
+            select(
+                history.challan_number,
+                history.challan_date,
+                history.division,
+                history.docket_number,
+                history.sent_through,
+                history.challan_by,
+                history.grc_number,
+                history.grc_date,
+                history.spare_code,
+                history.spare_description,
+                history.good_qty,
+                history.defective_qty,
+                pending.c.actual_pending_qty,
+            )
+            .join(pending, pending.c.id == history.id)
+            .where(history.challan_number.in_(challan_numbers))
+            .order_by(history.challan_number, history.id)
+        )
+
+        challans = {}
+        for row in result.mappings():
+            challan = challans.get(row["challan_number"])
+            if challan is None:
+                challan = challans[row["challan_number"]] = {
+                    "challan_number": row["challan_number"],
+                    "challan_date": format_date_ddmmyyyy(row["challan_date"]),
+                    "division": row["division"],
+                    "docket_number": row["docket_number"],
+                    "sent_through": row["sent_through"],
+                    "challan_by": row["challan_by"],
+                    "grc_rows": [],
+                }
+            challan["grc_rows"].append(
+                {
+                    "grc_number": row["grc_number"],
+                    "grc_date": format_date_ddmmyyyy(row["grc_date"]),
+                    "spare_code": row["spare_code"],
+                    "spare_description": row["spare_description"],
+                    "actual_pending_qty": row["actual_pending_qty"],
+                    "good_qty": row["good_qty"],
+                    "defective_qty": row["defective_qty"],
+                }
+            )
+        return challans
 
-        # Read the template PDF
+    def challan_report_payload(self, challan: dict, report_type: str) -> dict:
+        # History keeps every returned line; each report type prints only
+        # the lines with a quantity of its kind
+        quantities = GRC_REPORT_QUANTITIES[report_type]
+        return {
+            **challan,
+            "grc_rows": [
+                row
+                for row in challan["grc_rows"]
+                if sum(row[field] or 0 for field in quantities) > 0
+            ],
+        }
+
+    async def print_challan_batch(
+        self, jobs: List[GRCBatchPrintJob], challans: dict, output: str = "zip"
+    ) -> AsyncIterator[bytes]:
+        # Parts come from the report store; misses render in parallel on the
+        # report renderer and are stored for the next reprint. A ZIP sends
+        # each part as soon as it is done; a single PDF needs them all first.
+        async def render_part(job: GRCBatchPrintJob):
+            path = await self._challan_report_part(
+                challans[job.challan_number], job.report_type
+            )
+            return f"{job.challan_number}_{job.report_type}.pdf", path
+
+        tasks = [asyncio.ensure_future(render_part(job)) for job in jobs]
         try:
-            with open(template_path, "rb") as f:
-                template_bytes = f.read()
-        except FileNotFoundError:
-            raise FileNotFoundError(f"Template PDF not found at {template_path}")
-        template_buffer = io.BytesIO(template_bytes)
-        template_pdf = PdfReader(template_buffer)
-
-        # Merge overlays
-        writer = PdfWriter()
-        for i in range(len(template_pdf.pages)):
-            page = template_pdf.pages[i]
-            overlay_page = overlay.pages[min(i, len(overlay.pages) - 1)]
-            page.merge_page(overlay_page)
-            writer.add_page(page)
-
-        output_stream = io.BytesIO()
-        writer.write(output_stream)
-        output_stream.seek(0)
-        return output_stream
-    
+            if output == "pdf":
+                parts = await asyncio.gather(*tasks)
+                merged = await asyncio.to_thread(
+                    merge_reports, [path for _, path in parts]
+                )
+                async for chunk in stream_report(merged):
+                    yield chunk
+            else:
+
+                async def finished_parts():
+                    for part in asyncio.as_completed(tasks):
+                        yield await part
+
+                async for chunk in stream_report_zip(finished_parts()):
+                    yield chunk
+        finally:
+            # Client gone or a part failed: stop the rest, drop leftovers
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    discard_report(task.result()[1])
+
     def _apply_cgcel_filters(
         self,
         statement,
@@ -555,13 +1599,14 @@ class GRCCGCELService:
         grc_number=None,
         challan_number=None,
         model=None,
+        match="exact",
     ):
         if division:
             statement = statement.where(model.division == division)
 
         if spare_code:
             statement = statement.where(
-                model.spare_code.ilike(f"{spare_code}")
+                self._spare_match_filter(model, spare_code, match)
             )
 
         if from_grc_date:
@@ -586,6 +1631,31 @@ class GRCCGCELService:
 
         return statement
 
+    def _spare_match_filter(self, model, spare_code: str, match: str):
+        if match == "exact":
+            return model.spare_code.ilike(f"{spare_code}")
+        if match == "fuzzy":
+            # pg_trgm similarity operator, answered from the GIN indexes
+            return or_(
+                model.spare_code.bool_op("%")(spare_code),
+                model.spare_description.bool_op("%")(spare_code),
+            )
+        term = (
+            spare_code.replace("/", "//").replace("%", "/%").replace("_", "/_")
+        )
+        pattern = f"{term}%" if match == "prefix" else f"%{term}%"
+        # Plain ILIKE on the raw columns so the trigram indexes apply
+        return or_(
+            model.spare_code.ilike(pattern, escape="/"),
+            model.spare_description.ilike(pattern, escape="/"),
+        )
+
+    def _spare_match_rank(self, model, spare_code: str):
+        return func.greatest(
+            func.similarity(model.spare_code, spare_code, type_=Float),
+            func.similarity(model.spare_description, spare_code, type_=Float),
+        )
+
     async def enquiry_grc_cgcel(
         self,
         session: AsyncSession,
@@ -595,69 +1665,212 @@ class GRCCGCELService:
         to_grc_date: Optional[date] = None,
         grc_number: Optional[str] = None,
         challan_number: Optional[str] = None,
-        grc_status: Optional[str] = None,       
+        grc_status: Optional[str] = None,
         limit: int = 100,
         offset: int = 0,
         return_total: bool = False,
+        cursor: Optional[str] = None,
+        approximate: bool = False,
+        match: str = "exact",
     ):
-        if grc_status == "N":
-            statement = select(GRCCGCEL)
-        else:
-            statement = select(GRCCGCELReturnHistory)
+        if match not in GRC_SPARE_MATCH_MODES:
+            raise ValueError(
+                f"Invalid match '{match}', expected one of {', '.join(GRC_SPARE_MATCH_MODES)}"
+            )
+        model = GRCCGCEL if grc_status == "N" else GRCCGCELReturnHistory
+        key_columns = self._enquiry_key_columns(model)
+        # Enquiry columns plus any sort key the page needs for its cursor
         statement = self._apply_cgcel_filters(
-            statement,
+            select(
+                *[getattr(model, field) for field in GRC_ENQUIRY_FIELDS],
+                *[c for c in key_columns if c.key not in GRC_ENQUIRY_FIELDS],
+            ),
             division,
             spare_code,
             from_grc_date,
             to_grc_date,
             grc_number,
             challan_number,
-            GRCCGCEL if grc_status == "N" else GRCCGCELReturnHistory,
+            model,
+            match,
         )
+        # Ranked searches order by similarity first, then by the unique key
+        rank = None
+        if spare_code and match != "exact":
+            rank = self._spare_match_rank(model, spare_code)
 
         total_records = None
-        if return_total:
-            model = GRCCGCEL if grc_status == "N" else GRCCGCELReturnHistory
-            if model == GRCCGCELReturnHistory:
-                count_query = select(func.count(model.id))
+        total_is_estimate = False
+        if return_total and approximate and not cursor:
+            # Past a certain size the planner's estimate is good enough for
+            # the enquiry screen and far cheaper than counting. Keyset pages
+            # skip it like the exact count; the first page reported it.
+            estimate = await self._estimate_rows(session, statement)
+            if estimate >= GRC_APPROX_COUNT_MIN_ROWS:
+                total_records = estimate
+                total_is_estimate = True
+
+        # The exact total rides along with the page as a window count. Keyset
+        # pages leave it out; the first page already reported it.
+        with_count = return_total and total_records is None and not cursor
+        page = statement
+        if with_count:
+            page = page.add_columns(func.count().over().label("total_records"))
+
+        if rank is not None:
+            page = page.add_columns(rank.label("match_rank"))
+            page = page.order_by(rank.desc(), *key_columns)
+        else:
+            page = page.order_by(*key_columns)
+        if cursor:
+            # Keyset page: seek past the last key of the previous page
+            last_key = self._decode_cursor(cursor)
+            if len(last_key) != len(key_columns) + (rank is not None):
+                raise ValueError("Invalid cursor")
+            if rank is not None:
+                last_rank, *last_key = last_key
+                page = page.where(
+                    or_(
+                        rank < last_rank,
+                        (rank == last_rank)
+                        & (tuple_(*key_columns) > tuple_(*last_key)),
+                    )
+                )
             else:
-                subq = select(model.spare_code, model.grc_number).distinct().subquery()
-                count_query = select(func.count()).select_from(subq)
-            count_query = self._apply_cgcel_filters(
-                count_query,
-                division,
-                spare_code,
-                from_grc_date,
-                to_grc_date,
-                grc_number,
-                challan_number,
-                model,
-            )
-            total_result = await session.execute(count_query)
-            total_records = total_result.scalar() or 0
-        model = GRCCGCEL if grc_status == "N" else GRCCGCELReturnHistory
-        statement = statement.order_by(model.spare_code)
-        statement = statement.limit(limit).offset(offset)
+                page = page.where(tuple_(*key_columns) > tuple_(*last_key))
+        else:
+            page = page.offset(offset)
+        # One extra row tells whether another page follows
+        page = page.limit(limit + 1)
 
-        result = await session.execute(statement)
-        rows = result.scalars().all()
-        records = []
-        for row in rows:
-            # Build dict for only fields present in schema
-            record = {}
-            record['spare_code'] = getattr(row, 'spare_code', None)
-            record['spare_description'] = getattr(row, 'spare_description', None)
-            record['grc_number'] = getattr(row, 'grc_number', None)
-            record['grc_date'] = format_date_ddmmyyyy(getattr(row, 'grc_date', None))
-            record['issue_qty'] = getattr(row, 'issue_qty', None)
-            record['grc_pending_qty'] = getattr(row, 'grc_pending_qty', None)
-            record['returning_qty'] = getattr(row, 'returning_qty', None)
-            record['dispute_remark'] = getattr(row, 'dispute_remark', None)
-            record['challan_number'] = getattr(row, 'challan_number', None)
-            record['challan_date'] = format_date_ddmmyyyy(getattr(row, 'challan_date', None))
-            record['docket_number'] = getattr(row, 'docket_number', None)
-            records.append(GRCCGCELEnquiry(**record))
+        result = await session.execute(page)
+        page_rows = result.mappings().all()
+        if with_count:
+            if page_rows:
+                total_records = page_rows[0]["total_records"]
+            elif offset:
+                # Paged past the end, so no row carried the window count
+                total_records = await self._count_rows(session, statement)
+            else:
+                total_records = 0
+
+        next_cursor = None
+        if len(page_rows) > limit:
+            page_rows = page_rows[:limit]
+            last_key = [page_rows[-1][c.key] for c in key_columns]
+            if rank is not None:
+                last_key.insert(0, page_rows[-1]["match_rank"])
+            next_cursor = self._encode_cursor(last_key)
+
+        records = [self._enquiry_record(row) for row in page_rows]
+
+        enquiry = {"records": records, "next_cursor": next_cursor}
         if return_total:
-            return records, total_records
-        return records
+            enquiry["total_records"] = total_records
+            enquiry["total_is_estimate"] = total_is_estimate
+        return enquiry
+
+    def enquiry_export_statement(
+        self,
+        division: Optional[str] = None,
+        spare_code: Optional[str] = None,
+        from_grc_date: Optional[date] = None,
+        to_grc_date: Optional[date] = None,
+        grc_number: Optional[str] = None,
+        challan_number: Optional[str] = None,
+        grc_status: Optional[str] = None,
+        match: str = "exact",
+    ):
+        if match not in GRC_SPARE_MATCH_MODES:
+            raise ValueError(
+                f"Invalid match '{match}', expected one of {', '.join(GRC_SPARE_MATCH_MODES)}"
+            )
+        model = GRCCGCEL if grc_status == "N" else GRCCGCELReturnHistory
+        # Only the exported columns, so rows come back as plain mappings
+        statement = self._apply_cgcel_filters(
+            select(*[getattr(model, field) for field in GRC_ENQUIRY_FIELDS]),
+            division,
+            spare_code,
+            from_grc_date,
+            to_grc_date,
+            grc_number,
+            challan_number,
+            model,
+            match,
+        )
+        key_columns = self._enquiry_key_columns(model)
+        if spare_code and match != "exact":
+            rank = self._spare_match_rank(model, spare_code)
+            return statement.order_by(rank.desc(), *key_columns)
+        return statement.order_by(*key_columns)
+
+    async def stream_enquiry_export(
+        self, session: AsyncSession, statement, export_format: str = "csv"
+    ) -> AsyncIterator[bytes]:
+        # Server-side cursor: one batch of rows in memory at a time
+        result = await session.stream(
+            statement.execution_options(yield_per=GRC_EXPORT_BATCH_SIZE)
+        )
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == "csv" else None
+        if writer:
+            writer.writerow(GRC_ENQUIRY_FIELDS)
+        async for partition in result.mappings().partitions():
+            for row in partition:
+                record = self._enquiry_record(row)
+                if writer:
+                    writer.writerow([record[field] for field in GRC_ENQUIRY_FIELDS])
+                else:
+                    buffer.write(json.dumps(record, separators=(",", ":")))
+                    buffer.write("\n")
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    def _enquiry_record(self, row) -> dict:
+        # Row mapping to a dict shaped like GRCCGCELEnquiry
+        record = {field: row[field] for field in GRC_ENQUIRY_FIELDS}
+        for field in GRC_ENQUIRY_DATE_FIELDS:
+            record[field] = format_date_ddmmyyyy(record[field])
+        return record
+
+    async def _count_rows(self, session: AsyncSession, statement) -> int:
+        result = await session.execute(
+            statement.with_only_columns(func.count()).order_by(None)
+        )
+        return result.scalar() or 0
+
+    async def _estimate_rows(self, session: AsyncSession, statement) -> int:
+        # Row estimate from the planner, without executing the query. Filter
+        # values are rendered inline because EXPLAIN cannot take parameters.
+        connection = await session.connection()
+        compiled = statement.compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+        result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def _enquiry_key_columns(self, model) -> list:
+        # Unique sort keys, so pages never repeat or skip rows
+        if model is GRCCGCELReturnHistory:
+            return [GRCCGCELReturnHistory.id]
+        return [GRCCGCEL.spare_code, GRCCGCEL.grc_number]
+
+    def _encode_cursor(self, key: list) -> str:
+        payload = json.dumps(key, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    def _decode_cursor(self, cursor: str) -> list:
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (ValueError, UnicodeError) as exc:
+            raise ValueError("Invalid cursor") from exc
+        if not isinstance(key, list) or not key:
+            raise ValueError("Invalid cursor")
+        return key
 
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+from typing import Iterable, Optional
+
+from grc_cgcel.report import GRC_REPORT_LAYOUT_VERSION
+from utils.file_utils import safe_join
+
+GRC_REPORT_STORE_DIR = os.getenv(
+    "GRC_REPORT_STORE_DIR",
+    os.path.join(tempfile.gettempdir(), "grc_cgcel_report_store"),
+)
+GRC_REPORT_STORE_MAX_BYTES = int(
+    os.getenv("GRC_REPORT_STORE_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+
+
+class GRCReportStore:
+    """
+    Rendered challan PDFs on local disk, for instant reprints.
+
+    A finalized challan never changes, so its PDF is fully determined by
+    (challan_number, report_type, layout version, template hash) and is
+    stored under that name. A template edit changes the hash, which makes
+    the old copies unreachable until eviction removes them; a new
+    GRC_REPORT_LAYOUT_VERSION makes them unreachable too, and the next
+    eviction removes them outright. Eviction is otherwise least recently
+    used by file mtime, which get() refreshes, and keeps the directory under
+    max_bytes. The directory is shared by every worker on the host.
+    """
+
+    def __init__(
+        self,
+        directory: str = GRC_REPORT_STORE_DIR,
+        max_bytes: int = GRC_REPORT_STORE_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def path(self, challan_number: str, report_type: str, template_hash: str) -> str:
+        return safe_join(
+            self.directory,
+            f"{challan_number}_{report_type}_{self.layout}_{template_hash[:16]}.pdf",
+        )
+
+    @property
+    def layout(self) -> str:
+        return f"L{GRC_REPORT_LAYOUT_VERSION}"
+
+    def get(
+        self, challan_number: str, report_type: str, template_hash: str
+    ) -> Optional[str]:
+        path = self.path(challan_number, report_type, template_hash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(
+        self, challan_number: str, report_type: str, template_hash: str, rendered: str
+    ) -> str:
+        # Takes ownership of the rendered file. It is moved next to its final
+        # name first (the spool dir may be another filesystem), then renamed
+        # atomically, so a reader never sees half a file. The staging name
+        # is unique, so concurrent puts of one key never share it.
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(challan_number, report_type, template_hash)
+        fd, staged = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.move(rendered, staged)
+            os.replace(staged, path)
+        except BaseException:
+            self._remove(staged)
+            raise
+        self.stored += 1
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = []
+        for entry in self._entries():
+            # Stored by another layout version (or before versions were
+            # part of the name); never served again
+            if os.path.basename(entry[0]).split("_")[2:3] != [self.layout]:
+                if self._remove(entry[0]):
+                    self.evicted += 1
+                continue
+            entries.append(entry)
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_bytes:
+                break
+            total -= size
+            if self._remove(path):
+                self.evicted += 1
+
+    def purge(self, challan_numbers: Optional[Iterable[str]] = None) -> dict:
+        # Everything, or only the given challans (any report type/template)
+        prefixes = tuple(f"{number}_" for number in challan_numbers or ())
+        removed = 0
+        removed_bytes = 0
+        for path, size, _ in self._entries():
+            if prefixes and not os.path.basename(path).startswith(prefixes):
+                continue
+            if self._remove(path):
+                removed += 1
+                removed_bytes += size
+        return {"removed": removed, "removed_bytes": removed_bytes}
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "files": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stored": self.stored,
+            "evicted": self.evicted,
+        }
+
+    def _entries(self) -> list:
+        # (path, size, mtime) of every stored PDF
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(".pdf"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _remove(self, path: str) -> bool:
+        # Another worker may have removed it first
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
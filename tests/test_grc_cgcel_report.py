@@ -0,0 +1,79 @@
+"""
+Render checks for GRC challan PDFs (grc_cgcel/report.py).
+
+The template is generated per test, so only ReportLab and PyPDF2 are
+needed; the real templates in static/ are not touched. It is drawn without
+text, so every font on a rendered page comes from the overlay.
+"""
+
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from grc_cgcel.report import GRC_REPORT_ROWS_PER_PAGE, grc_templates, render_grc_report
+
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    for name in ("grc_cgcel_all.pdf", "grc_cgcel_good.pdf", "grc_cgcel_defective.pdf"):
+        can = canvas.Canvas(str(tmp_path / name), pagesize=A4)
+        can.rect(10, 20, 575, 800)
+        can.line(10, 680, 585, 680)
+        can.showPage()
+        can.save()
+    monkeypatch.setattr(grc_templates, "static_dir", str(tmp_path))
+    monkeypatch.setattr(grc_templates, "_templates", {})
+    monkeypatch.setattr(grc_templates, "_hashes", {})
+    return tmp_path
+
+
+def _challan(row_count: int) -> dict:
+    return {
+        "challan_number": "G00042",
+        "challan_date": "02-01-2026",
+        "division": "FANS",
+        "docket_number": "D1",
+        "sent_through": "COURIER",
+        "grc_rows": [
+            {
+                "grc_number": 1000 + i,
+                "grc_date": "01-01-2026",
+                "spare_code": f"SPX{i}",
+                "spare_description": "FAN MOTOR",
+                "actual_pending_qty": 3,
+                "good_qty": 2,
+                "defective_qty": 1,
+            }
+            for i in range(row_count)
+        ],
+    }
+
+
+def test_render_grc_report_text_is_extractable(templates, tmp_path):
+    # Overlay fonts must resolve to real font objects in the output
+    output_path = str(tmp_path / "challan.pdf")
+    row_count = 2 * GRC_REPORT_ROWS_PER_PAGE + 9
+
+    page_count = render_grc_report("All", _challan(row_count), "clerk", output_path)
+
+    reader = PdfReader(output_path)
+    assert page_count == len(reader.pages) == 3
+    fonts = reader.pages[0]["/Resources"]["/Font"]
+    assert {font.get_object()["/Subtype"] for font in fonts.values()} == {"/Type1"}
+    first_page = reader.pages[0].extract_text()
+    assert "G00042" in first_page
+    assert "SPX0" in first_page
+    assert "Page 1 of 3" in first_page
+    assert f"SPX{row_count - 1}" in reader.pages[2].extract_text()
+
+
+def test_render_grc_report_leaves_cached_template_unchanged(templates, tmp_path):
+    template_page = grc_templates.get("Good").pages[0]
+    contents = template_page.get_contents().get_data()
+    resources = repr(template_page["/Resources"])
+
+    render_grc_report("Good", _challan(3), "clerk", str(tmp_path / "challan.pdf"))
+
+    assert template_page.get_contents().get_data() == contents
+    assert repr(template_page["/Resources"]) == resources